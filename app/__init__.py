@@ -12,6 +12,9 @@ from flask_jwt_extended import JWTManager
 db = SQLAlchemy()
 migrate = Migrate()
 
+# SQLSTATE of statements canceled by Postgres, e.g. by their statement_timeout
+QUERY_CANCELED = '57014'
+
 def create_app(config):
     app = Flask(__name__)
 
@@ -20,6 +23,30 @@ def create_app(config):
 
     db.init_app(app)
     migrate.init_app(app, db)
+
+    # in-process cache for the public read endpoints
+    from app.utils.cache import ResponseCache
+    app.extensions['response_cache'] = ResponseCache(
+        app.config.get('RESPONSE_CACHE_SIZE', 32),
+        max_entry_size=app.config.get('RESPONSE_CACHE_MAX_ENTRY_SIZE', 8 * 1024 * 1024))
+
+    # pooled, keep-alive HTTP session for outbound calls (Slack, the webhook)
+    from app.utils.outbound import OutboundHTTP
+    app.extensions['outbound_http'] = OutboundHTTP(
+        pool_size=app.config.get('OUTBOUND_POOL_SIZE', 10),
+        timeout=app.config.get('OUTBOUND_TIMEOUT', 10))
+
+    # Slack notifications are sent from a background thread, requests only queue them
+    from app.utils.dispatcher import BackgroundDispatcher
+    app.extensions['slack_dispatcher'] = BackgroundDispatcher(
+        'slack-notifier', app.logger,
+        max_size=app.config.get('SLACK_QUEUE_SIZE', 100),
+        retries=app.config.get('SLACK_RETRIES', 2),
+        backoff=app.config.get('SLACK_RETRY_BACKOFF', 1.0))
+
+    # the webhook is called from a background thread too, coalescing bursts of triggers
+    from app.utils.webhook import WebhookNotifier
+    app.extensions['webhook_notifier'] = WebhookNotifier(app)
     
     # setup flask_jwt_extended for authentication
     app.config['JWT_SECRET_KEY'] = app.config['SECRET_KEY']
@@ -34,6 +61,20 @@ def create_app(config):
     from app.api import api as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix='/api/v1')
 
+    # queries canceled by their statement timeout (see app/utils/database.py), and requests that
+    # couldn't get a database connection in time, are worth retrying later
+    from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+
+    @app.errorhandler(OperationalError)
+    def database_error(e):
+        if getattr(e.orig, 'pgcode', None) == QUERY_CANCELED:
+            return 'The database query took too long and was canceled', 503
+        return str(e), 500
+
+    @app.errorhandler(PoolTimeoutError)
+    def database_pool_timeout(e):
+        return 'No database connection available, try again later', 503
+
     # register an error handler to return full exceptions for server errors
     @app.errorhandler(500)
     def internal_server_error(e):
@@ -1,4 +1,3 @@
-from collections import defaultdict
 import flask
 from flask import request
 
@@ -6,16 +5,64 @@ from app.models.data import *
 from app import db
 
 from sqlalchemy import func, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.sql import label
 
 
-# grabbed this solution from:
-# https://stackoverflow.com/questions/45775724/sqlalchemy-group-by-and-return-max-date?rq=1
-#
-# Returns a SQLAlchemy BaseQuery object. If input state is not None, will return daily data only
-# for the input state.
-def states_daily_query(state=None, preview=False):
-    # first retrieve latest published batch per state
+# number of rows fetched at a time from the server-side cursor when streaming query results
+STREAM_BATCH_SIZE = 1000
+
+# number of array items buffered before a chunk of JSON output is sent to the client
+JSON_CHUNK_ITEMS = 500
+
+
+def make_json_array_response(items, key=None):
+    """Generate a streamed Flask response containing a JSON array of ``items``.
+
+    Items are serialized one at a time as the client reads the response, so ``items`` can be a
+    generator over a query streaming from a server-side cursor and the whole output is never held
+    in memory at once.
+
+    Args:
+        items: iterable of JSON serializable objects, e.g. the ``to_dict()`` output of model rows
+        key (str, optional): if set, the array is wrapped in an object under this key, e.g.
+            ``{"batches": [...]}``
+
+    Returns: Flask response in ``application/json`` format
+    """
+    output = json_array_chunks(items, key)
+    if flask.has_request_context():
+        # keep the request (and its DB session) around until the whole response has been sent
+        output = flask.stream_with_context(output)
+    return flask.Response(output, mimetype='application/json')
+
+
+def json_array_chunks(items, key=None, first=True, last=True):
+    """Serialize ``items`` as a JSON array, yielding it in chunks of ``JSON_CHUNK_ITEMS`` items.
+
+    ``first`` and ``last`` allow serializing an array in several calls, one per slice of its items:
+    only the first slice opens the array, and only the last one closes it.
+    """
+    if first:
+        chunk = ['{%s: [' % flask.json.dumps(key) if key else '[']
+        separator = ''
+    else:
+        chunk = []
+        separator = ','
+    for item in items:
+        chunk.append(separator + flask.json.dumps(item))
+        separator = ','
+        if len(chunk) >= JSON_CHUNK_ITEMS:
+            yield ''.join(chunk)
+            chunk = []
+    if last:
+        chunk.append(']}\n' if key else ']\n')
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _latest_batches_filters(state, preview):
     filter_list = [Batch.dataEntryType.in_(['daily', 'edit'])]
     if state is not None:
         filter_list.append(CoreData.state == state)
@@ -24,14 +71,46 @@ def states_daily_query(state=None, preview=False):
         filter_list.append(Batch.isPublished == False)
     else:
         filter_list.append(Batch.isPublished == True)
+    return filter_list
 
-    latest_state_daily_batches = db.session.query(
-        CoreData.state, CoreData.date, func.max(CoreData.batchId).label('maxBid')
-        ).join(Batch
-        ).filter(*filter_list
+
+def _latest_batches_subquery(state=None, preview=False, with_row_number=False):
+    """Return a subquery with the latest batch ID (``maxBid``) for each (state, date).
+
+    Published data is read straight from the ``latestCoreData`` table, which is maintained on
+    publish. Preview data is rarely requested, so it's still computed by grouping the unpublished
+    ``coreData`` revisions.
+
+    If ``with_row_number`` is set, the subquery also has a ``row`` column numbering each state's
+    dates, most recent first.
+    """
+    if not preview:
+        columns = [LatestCoreData.state, LatestCoreData.date, LatestCoreData.batchId.label('maxBid')]
+        if with_row_number:
+            columns.append(func.row_number().over(
+                partition_by=LatestCoreData.state, order_by=LatestCoreData.date.desc()).label('row'))
+        query = db.session.query(*columns)
+        if state is not None:
+            query = query.filter(LatestCoreData.state == state)
+        return query.subquery('latest_state_daily_batches')
+
+    # grabbed this solution from:
+    # https://stackoverflow.com/questions/45775724/sqlalchemy-group-by-and-return-max-date?rq=1
+    columns = [CoreData.state, CoreData.date, func.max(CoreData.batchId).label('maxBid')]
+    if with_row_number:
+        columns.append(func.row_number().over(
+            partition_by=CoreData.state, order_by=CoreData.date.desc()).label('row'))
+    return db.session.query(*columns).join(Batch
+        ).filter(*_latest_batches_filters(state, preview)
         ).group_by(CoreData.state, CoreData.date
         ).subquery('latest_state_daily_batches')
 
+
+# Returns a SQLAlchemy BaseQuery object. If input state is not None, will return daily data only
+# for the input state. If dates is not None, will only return data for those dates.
+def states_daily_query(state=None, preview=False, dates=None):
+    latest_state_daily_batches = _latest_batches_subquery(state=state, preview=preview)
+
     latest_daily_data_query = db.session.query(CoreData).join(
         latest_state_daily_batches,
         and_(
@@ -40,10 +119,98 @@ def states_daily_query(state=None, preview=False):
             CoreData.date == latest_state_daily_batches.c.date
         )).order_by(CoreData.date.desc()
         ).order_by(CoreData.state)
+    if dates is not None:
+        latest_daily_data_query = latest_daily_data_query.filter(
+            latest_state_daily_batches.c.date.in_(dates))
 
     return latest_daily_data_query
 
 
+def published_state_date_query(state, date):
+    """Query all the published revisions of a state's date, most recent first"""
+    return db.session.query(CoreData).join(Batch).filter(
+        Batch.isPublished == True,
+        CoreData.state == state,
+        CoreData.date == date
+        ).order_by(CoreData.batchId.desc())
+
+
+def state_date_history_query(state, date):
+    """Query all the published revisions of a state's date, most recent first, with their batches.
+
+    Rows are ``(CoreData, changedDatesMin, changedDatesMax)``. Each revision's batch and state are
+    loaded by the same statement, and the batch's changed dates are computed in SQL, so the other
+    coreData rows of the batches are never loaded.
+    """
+    return published_state_date_query(state, date).join(CoreData.state_obj).options(
+        contains_eager(CoreData.batch), contains_eager(CoreData.state_obj)
+        ).add_columns(Batch.changedDatesMin, Batch.changedDatesMax)
+
+
+def states_daily_rows_query(state=None, preview=False, limit=None):
+    """Query the same data as ``states_daily_query``, as plain column values instead of ``CoreData``
+    objects.
+
+    Reading column values directly skips ORM hydration (identity map, instance state and the
+    ``state_obj`` relationship), which is what dominates the cost of the large public reads. Each
+    row also has a ``totalTestResultsSource`` column from the joined state, so that it can be
+    serialized with ``CoreData.row_to_dict``.
+
+    Args:
+        state (str, optional): only return data for this state
+        preview (bool, optional): return data in the preview state instead of published data
+        limit (int, optional): only return the latest ``limit`` dates for each state
+
+    Returns:
+        A SQLAlchemy ``Query`` of rows, sorted by date descending and state
+    """
+    latest_state_daily_batches = _latest_batches_subquery(
+        state=state, preview=preview, with_row_number=limit is not None)
+
+    query = db.session.query(
+        *CoreData.__table__.columns,
+        State.totalTestResultsFieldDbColumn.label('totalTestResultsSource')
+        ).join(latest_state_daily_batches, and_(
+            CoreData.batchId == latest_state_daily_batches.c.maxBid,
+            CoreData.state == latest_state_daily_batches.c.state,
+            CoreData.date == latest_state_daily_batches.c.date)
+        ).join(State, State.state == CoreData.state)
+
+    if limit is not None:
+        query = query.filter(latest_state_daily_batches.c.row <= limit)
+
+    return query.order_by(CoreData.date.desc()).order_by(CoreData.state)
+
+
+def update_latest_core_data(batch_id):
+    """Refresh the ``latestCoreData`` table for every (state, date) touched by a batch.
+
+    Must be called whenever a batch becomes published. Only the (state, date) keys present in the
+    batch are recomputed, so the cost is proportional to the size of the batch rather than to the
+    size of the whole history. The caller is responsible for committing the session.
+
+    Args:
+        batch_id (int): ID of the batch whose (state, date) keys should be refreshed
+    """
+    touched_keys = db.session.query(CoreData.state, CoreData.date).filter(
+        CoreData.batchId == batch_id).subquery('touched_keys')
+
+    latest_published = db.session.query(
+        CoreData.state, CoreData.date, func.max(CoreData.batchId)
+        ).join(Batch
+        ).join(touched_keys, and_(
+            CoreData.state == touched_keys.c.state,
+            CoreData.date == touched_keys.c.date)
+        ).filter(*_latest_batches_filters(None, preview=False)
+        ).group_by(CoreData.state, CoreData.date)
+
+    stmt = insert(LatestCoreData.__table__).from_select(
+        ['state', 'date', 'batchId'], latest_published.statement)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['state', 'date'], set_={'batchId': stmt.excluded.batchId})
+    db.session.execute(stmt)
+
+
 def us_daily_query(preview=False, date_format='%Y-%m-%d'):
     """Query US Daily Data
 
@@ -60,7 +227,12 @@ def us_daily_query(preview=False, date_format='%Y-%m-%d'):
     Returns:
         dict: Dictionary of US daily data, one row per date
     """
-    states_daily = states_daily_query(preview=preview).subquery('states_daily')
+    return format_us_daily([day._asdict() for day in us_daily_rows_query(preview)], date_format)
+
+
+def us_daily_rows_query(preview=False):
+    """Query the US daily sums behind ``us_daily_query``, one row per date, most recent first"""
+    states_daily = states_daily_rows_query(preview=preview).subquery('states_daily')
 
     # get a list of columns to aggregate, sum over those from the states_daily subquery
     colnames = CoreData.numeric_fields()
@@ -69,70 +241,27 @@ def us_daily_query(preview=False, date_format='%Y-%m-%d'):
     # correspond to the number of states, assuming `states_daily` returns
     # only a single row per state.
     col_list.append(label('states', func.count()))
-    us_daily = db.session.query(
+    # totalTestResults depends on each state's source column, so it's computed per row before
+    # summing
+    total_test_results = CoreData.total_test_results_expression(
+        states_daily.c, states_daily.c.totalTestResultsSource)
+    col_list.append(label('totalTestResults', func.coalesce(func.sum(total_test_results), 0)))
+    return db.session.query(
         states_daily.c.date, *col_list
         ).group_by(states_daily.c.date
-        ).order_by(states_daily.c.date.desc()
-        ).all()
-
-    # short term hack: we need to get totalTestResults as an aggregate, but since it's a hybrid
-    # property, this is difficult without complex sql. Instead, getting states daily results as
-    # CoreData objects, and going to do aggregation in Python.
-    date_total_results_dict = defaultdict(int)
-    states_daily_full_results = states_daily_query(preview=preview).all()
-    for result in states_daily_full_results:
-        if result.totalTestResults is not None:
-            date_total_results_dict[result.date] += result.totalTestResults
-
-    us_data_by_date = []
-    for day in us_daily:
-        result_dict = day._asdict()
-        # grab totalTestResults from the aggregation-by-date dict we just computed, and update
-        # date object formats
-        result_dict.update({
-            'totalTestResults': date_total_results_dict[day.date],
-            'dateChecked': day.date.isoformat(),
-            'date': day.date.strftime(date_format),
-        })
-        us_data_by_date.append(result_dict)
+        ).order_by(states_daily.c.date.desc())
 
-    return us_data_by_date
 
+def format_us_daily(us_daily, date_format='%Y-%m-%d'):
+    """Format the dates of ``us_daily_rows_query`` rows, given as dicts, in place.
 
-def states_daily_query_with_limit(state=None, preview=False, limit=None):
-    ''' TODO: shortly, this method will eventually replace the top
-    `states_daily_query`, but for now, we're using it as a
-    separate method
-    '''
-
-    # first retrieve latest published batch per state
-    filter_list = [Batch.dataEntryType.in_(['daily', 'edit'])]
-    if state is not None:
-        filter_list.append(CoreData.state == state)
-
-    if preview:
-        filter_list.append(Batch.isPublished == False)
-    else:
-        filter_list.append(Batch.isPublished == True)
-
-    latest_state_daily_batches = db.session.query(
-        CoreData.state, CoreData.date, func.max(CoreData.batchId).label('maxBid'),
-        func.row_number().over(
-            partition_by=CoreData.state, order_by=CoreData.date.desc()).label('row')
-    ).join(Batch).filter(*filter_list).group_by(
-        CoreData.date, CoreData.state
-    ).order_by(CoreData.date.desc(), CoreData.state).subquery('latest_state_daily_batches')
-
-    filter_list = []
-    if limit is not None:
-        filter_list = [latest_state_daily_batches.c.row <= limit]
-
-    latest_daily_data_query = db.session.query(CoreData).join(
-        latest_state_daily_batches,
-        and_(
-            CoreData.batchId == latest_state_daily_batches.c.maxBid,
-            CoreData.state == latest_state_daily_batches.c.state,
-            CoreData.date == latest_state_daily_batches.c.date
-        )).filter(*filter_list).order_by(CoreData.date.desc()).order_by(CoreData.state)
-
-    return latest_daily_data_query
+    Returns:
+        list: the formatted dicts
+    """
+    for result_dict in us_daily:
+        day = result_dict['date']
+        result_dict.update({
+            'dateChecked': day.isoformat(),
+            'date': day.strftime(date_format),
+        })
+    return us_daily
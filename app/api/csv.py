@@ -1,16 +1,17 @@
 import csv
-from datetime import timedelta
 from io import StringIO
 
 import flask
-from dateutil import tz
-from flask import make_response, request
+from flask import request
 from flask_restful import inputs
 
 from app.api import api
-from app.api.common import us_daily_query, states_daily_query, states_daily_query_with_limit
+from app.api.common import us_daily_query, states_daily_rows_query, STREAM_BATCH_SIZE
 from app.api.csv_columns import *
-from app.models.data import State
+from app.models.data import CoreData, State
+from app.utils.cache import cached_response, conditional_response
+from app.utils.database import statement_timeout
+from app.utils.timeformat import format_csv_date_checked
 
 """Represents the recipe to generate a column of CSV output data. 
 
@@ -23,24 +24,45 @@ Example: ``CSVColumn(label="State", model_column=None, blank=True)``
 """
 
 
+# number of rows buffered before a chunk of CSV output is sent to the client
+CSV_CHUNK_ROWS = 500
+
+
 def make_csv_response(columns, data):
     """Generate a Flask response containing CSV data from `data` using the column definitions in ``columns``
 
     Outputs a header row, containing each column identified by the column's label in the order provided, followed by
     one line for each ``data`` row.
 
+    The response is streamed: rows are pulled from ``data`` and written out in chunks of ``CSV_CHUNK_ROWS`` as the
+    client reads them, so ``data`` can be a generator or a query streaming from a server-side cursor and the output is
+    never held in memory all at once.
+
     Args:
         columns: A list of `CSVColumn` definitions. The output will contain each column in the given order
-        data: SQLAlchemy query results or a dict to be output in CSV format
+        data: An iterable of SQLAlchemy query results or dicts to be output in CSV format
 
     Returns: Flask response in ``text/csv`` format
     """
-    si = StringIO()
-    writer = csv.writer(si)
+    output = csv_chunks(columns, data)
+    if flask.has_request_context():
+        # keep the request (and its DB session) around until the whole response has been sent
+        output = flask.stream_with_context(output)
+    output = flask.Response(output)
+    output.headers["Content-type"] = "text/csv"
+
+    return output
 
-    # write a header row
-    writer.writerow([column.label for column in columns])
 
+def csv_chunks(columns, data, header=True):
+    """Write ``data`` in CSV format using the column definitions in ``columns``, yielding the output in chunks of
+    ``CSV_CHUNK_ROWS`` rows.
+
+    Args:
+        columns: A list of `CSVColumn` definitions. The output will contain each column in the given order
+        data: An iterable of SQLAlchemy query results or dicts to be output in CSV format
+        header (bool, optional): start with a header row. Output written in several calls only has it in the first one
+    """
     # data may come in the form of sqlalchemy query results or a dict
     def get_data(datum, key, blank):
         if blank is True:
@@ -50,74 +72,110 @@ def make_csv_response(columns, data):
         else:
             return datum.__getattribute__(key)
 
+    si = StringIO()
+    writer = csv.writer(si)
+
+    # write a header row
+    if header:
+        writer.writerow([column.label for column in columns])
+
     # write data rows
-    for datum in data:
+    for i, datum in enumerate(data, 1):
         writer.writerow([get_data(datum, column.model_column, column.blank) for column in columns])
-    output = make_response(si.getvalue())
-    output.headers["Content-type"] = "text/csv"
+        if i % CSV_CHUNK_ROWS == 0:
+            yield si.getvalue()
+            si.seek(0)
+            si.truncate(0)
+    if si.tell():
+        yield si.getvalue()
 
-    return output
+
+def reformat_states_daily(latest_daily_data, current_only=False, state_latest_dates=None):
+    """Rewrite states daily rows as dicts with date formats matching the old public sheet.
+
+    Args:
+        latest_daily_data: iterable of rows from ``states_daily_rows_query``, sorted by date descending
+        current_only (bool, optional): only output the latest row for each state
+        state_latest_dates (dict, optional): latest date seen for each state, to carry the ``current_only`` filtering
+            over successive calls when the rows are reformatted in several slices
+
+    Yields:
+        dict: one reformatted row at a time
+    """
+    if state_latest_dates is None:
+        state_latest_dates = {}
+    for data in latest_daily_data:
+        # for the /current endpoint, only add the row if it's the latest data for the state
+        if current_only:
+            # if we've seen this state before and the one we saw is newer, skip this row
+            if data.state in state_latest_dates and state_latest_dates[data.state] > data.date:
+                continue
+            state_latest_dates[data.state] = data.date
+
+        result_dict = CoreData.row_to_dict(data)
+        result_dict.update({
+            'date': data.date.strftime("%Y%m%d"),
+            'dateChecked': format_csv_date_checked(data.dateChecked) if data.dateChecked else ""
+        })
+        yield result_dict
+
+
+STATES_INFO_COLUMNS = [
+    CSVColumn(label="State", model_column="state"),
+    CSVColumn(label="COVID-19 site", model_column="covid19Site"),
+    CSVColumn(label="COVID-19 site (secondary)", model_column="covid19SiteSecondary"),
+    CSVColumn(label="COVID-19 site (tertiary)", model_column="covid19SiteTertiary"),
+    CSVColumn(label="COVID-19 site (quaternary)", model_column="covid19SiteQuaternary"),
+    CSVColumn(label="COVID-19 site (quinary)", model_column="covid19SiteQuinary"),
+    CSVColumn(label="Twitter", model_column="twitter"),
+    CSVColumn(label="Notes", model_column="notes"),
+    CSVColumn(label="COVID Tracking Project preferred total test units",
+              model_column="covidTrackingProjectPreferredTotalTestUnits"),
+    CSVColumn(label="COVID Tracking Project preferred total test field",
+              model_column="covidTrackingProjectPreferredTotalTestField")]
+
+
+def states_daily_csv_columns(endpoint):
+    """CSV columns of the states daily (``api.states_daily``) and current (``api.states_current``) endpoints"""
+    return select(STATES_DAILY if endpoint == 'api.states_daily' else STATES_CURRENT)
+
+
+def us_daily_csv_columns(endpoint):
+    """CSV columns of the US daily (``api.us_daily``) and current (``api.us_current``) endpoints"""
+    return select(US_DAILY_COLUMNS if endpoint == 'api.us_daily' else US_CURRENT_COLUMNS)
 
 
 @api.route('/public/states/info.csv', methods=['GET'])
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_states_csv():
     states = State.query.order_by(State.state.asc()).all()
-    columns = [CSVColumn(label="State", model_column="state"),
-               CSVColumn(label="COVID-19 site", model_column="covid19Site"),
-               CSVColumn(label="COVID-19 site (secondary)", model_column="covid19SiteSecondary"),
-               CSVColumn(label="COVID-19 site (tertiary)", model_column="covid19SiteTertiary"),
-               CSVColumn(label="COVID-19 site (quaternary)", model_column="covid19SiteQuaternary"),
-               CSVColumn(label="COVID-19 site (quinary)", model_column="covid19SiteQuinary"),
-               CSVColumn(label="Twitter", model_column="twitter"),
-               CSVColumn(label="Notes", model_column="notes"),
-               CSVColumn(label="COVID Tracking Project preferred total test units",
-                         model_column="covidTrackingProjectPreferredTotalTestUnits"),
-               CSVColumn(label="COVID Tracking Project preferred total test field",
-                         model_column="covidTrackingProjectPreferredTotalTestField")]
-
-    return make_csv_response(columns, states)
+    return make_csv_response(STATES_INFO_COLUMNS, states)
 
 
 @api.route('/public/states/daily.csv', methods=['GET'], endpoint='states_daily')
 @api.route('/public/states/current.csv', methods=['GET'], endpoint='states_current')
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_states_daily_csv():
     flask.current_app.logger.info('Retrieving States Daily')
     include_preview = request.args.get('preview', default=False, type=inputs.boolean)
-    latest_daily_data = states_daily_query(preview=include_preview).all()
+    latest_daily_data = states_daily_rows_query(preview=include_preview).yield_per(STREAM_BATCH_SIZE)
 
     # rewrite date formats to match the old public sheet
-    reformatted_data = []
-    state_latest_dates = {}
-    eastern_time = tz.gettz('EST')
-    for data in latest_daily_data:
-        result_dict = data.to_dict()
-        result_dict.update({
-            'date': data.date.strftime("%Y%m%d"),
-            # due to DST issues, this time needs to be advanced forward one hour to match the old output
-            'dateChecked': (data.dateChecked.astimezone(eastern_time) + timedelta(hours=1)).strftime(
-                "%-m/%d/%Y %H:%M") if data.dateChecked else ""
-        })
-
-        # for the /current endpoint, only add the row if it's the latest data for the state
-        if request.endpoint == 'api.states_current':
-            # if we've seen this state before and the one we saw is newer, skip this row
-            if data.state in state_latest_dates and state_latest_dates[data.state] > data.date:
-                continue
-            state_latest_dates[data.state] = data.date
-
-        # add the row to the output
-        reformatted_data.append(result_dict)
-
-    columns = STATES_CURRENT
-    if request.endpoint == 'api.states_daily':
-        columns = STATES_DAILY
-    columns = select(columns)
+    reformatted_data = reformat_states_daily(
+        latest_daily_data, current_only=request.endpoint == 'api.states_current')
 
-    return make_csv_response(columns, reformatted_data)
+    return make_csv_response(states_daily_csv_columns(request.endpoint), reformatted_data)
 
 
 @api.route('/public/us/daily.csv', methods=['GET'], endpoint='us_daily')
 @api.route('/public/us/current.csv', methods=['GET'], endpoint='us_current')
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_us_daily_csv():
     flask.current_app.logger.info('Retrieving US Daily')
     include_preview = request.args.get('preview', default=False, type=inputs.boolean)
@@ -128,44 +186,22 @@ def get_us_daily_csv():
     if request.endpoint == 'api.us_current':
         us_data_by_date = us_data_by_date[:1]
 
-    columns = US_CURRENT_COLUMNS
-    if request.endpoint == 'api.us_daily':
-        columns = US_DAILY_COLUMNS
-    columns = select(columns)
-    return make_csv_response(columns, us_data_by_date)
+    return make_csv_response(us_daily_csv_columns(request.endpoint), us_data_by_date)
 
 
 @api.route('/internal/states/daily.csv', methods=['GET'], endpoint='states_latest')
+@cached_response
 def get_latest_states_daily_csv():
     preview = request.args.get('preview', default=False, type=inputs.boolean)
     days = request.args.get('days', default=1, type=inputs.positive)
     flask.current_app.logger.info('Retrieving US daily for {} days with preview = {}'.format(
         days, preview))
 
-    latest_daily_data = states_daily_query_with_limit(preview=preview, limit=days).all()
+    latest_daily_data = states_daily_rows_query(
+        preview=preview, limit=days).yield_per(STREAM_BATCH_SIZE)
 
     # rewrite date formats to match the old public sheet
-    reformatted_data = []
-    state_latest_dates = {}
-    eastern_time = tz.gettz('EST')
-    for data in latest_daily_data:
-        result_dict = data.to_dict()
-        result_dict.update({
-            'date': data.date.strftime("%Y%m%d"),
-            # due to DST issues, this time needs to be advanced forward one hour to match the old output
-            'dateChecked': (data.dateChecked.astimezone(eastern_time) + timedelta(hours=1)).strftime(
-                "%-m/%d/%Y %H:%M") if data.dateChecked else ""
-        })
-
-        # for the /current endpoint, only add the row if it's the latest data for the state
-        if request.endpoint == 'api.states_current':
-            # if we've seen this state before and the one we saw is newer, skip this row
-            if data.state in state_latest_dates and state_latest_dates[data.state] > data.date:
-                continue
-            state_latest_dates[data.state] = data.date
-
-        # add the row to the output
-        reformatted_data.append(result_dict)
+    reformatted_data = reformat_states_daily(latest_daily_data)
 
     # need to return all columns, with their db names
     columns = [CSVColumn(label=c.name, model_column=c.name) for c in CoreData.__table__.columns]
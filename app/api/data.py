@@ -1,15 +1,23 @@
 """Registers the necessary routes for the core data model. """
 
+import collections
 from datetime import datetime
+from types import SimpleNamespace
 
 import flask
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func, and_
+from flask_restful import inputs
+from sqlalchemy import func, and_, distinct
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert
 
 from app import db
 from app.api import api
-from app.api.common import states_daily_query
+from app.api.common import states_daily_query, published_state_date_query, state_date_history_query, \
+    update_latest_core_data, make_json_array_response, STREAM_BATCH_SIZE
 from app.models.data import Batch, CoreData, State
+from app.utils.cache import bump_data_generation
+from app.utils.database import statement_timeout
 from app.utils.editdiff import EditDiff, ChangedValue, ChangedRow
 from app.utils.slacknotifier import notify_slack, notify_slack_error, exceptions_to_slack
 from app.utils.validation import validate_core_data_payload, validate_edit_data_payload
@@ -38,25 +46,128 @@ def test_auth():
 ##############################################################################################
 
 
+def batch_summary_query():
+    """Query lightweight summaries of batches, computed with a single aggregate query.
+
+    Each row has the main batch fields, and the number of coreData rows (``numRows``), the range of
+    their dates (``changedDatesMin``, ``changedDatesMax``) and the states they're for (``states``).
+    """
+    return db.session.query(
+        Batch.batchId, Batch.createdAt, Batch.publishedAt, Batch.shiftLead, Batch.batchNote,
+        Batch.dataEntryType, Batch.isPublished, Batch.isRevision,
+        func.count(CoreData.batchId).label('numRows'),
+        func.min(CoreData.date).label('changedDatesMin'),
+        func.max(CoreData.date).label('changedDatesMax'),
+        func.array_agg(distinct(CoreData.state)).label('states')
+        ).outerjoin(CoreData, CoreData.batchId == Batch.batchId
+        ).group_by(Batch.batchId)
+
+
+def batch_summary_to_dict(row):
+    # like Batch.to_dict, null columns are left out but the changed dates are always there
+    d = {name: value for name, value in row._asdict().items()
+         if value is not None or name in ('changedDatesMin', 'changedDatesMax')}
+    # batches without rows aggregate the single null state of the outer join
+    d['states'] = sorted(state for state in d['states'] if state is not None)
+    return d
+
+
+def _get_batches_view():
+    view = flask.request.args.get('view', default='full')
+    if view not in ('full', 'summary'):
+        flask.abort(400, 'Unknown view: %s' % view)
+    return view
+
+
+def _get_batches_arg(name, type, default=None):
+    """Return a query argument converted with ``type``, rejecting invalid values with a 400
+    rather than ignoring them"""
+    value = flask.request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return type(value)
+    except ValueError:
+        flask.abort(400, 'Invalid value for %s: %s' % (name, value))
+
+
 @api.route('/batches', methods=['GET'])
 def get_batches():
-    flask.current_app.logger.info('Retrieving all batches')
-    batches = Batch.query.all()
-    # for each batch, attach its coreData rows
-
-    return flask.jsonify({
-        'batches': [batch.to_dict() for batch in batches]
-    })
+    """List batches in batchId order.
+
+    All the batches are listed unless ``after`` or ``limit`` is given.
+
+    Optional query parameters:
+        after: only list batches with a batchId greater than this one. Paginate by passing the
+            last batchId of the previous page, until a page comes back empty
+        limit: list at most this many batches, at most ``BATCHES_MAX_PAGE_SIZE``. Pages have
+            ``BATCHES_PAGE_SIZE`` batches if only ``after`` is given
+        isPublished, dataEntryType: only list batches with these values
+        state: only list batches containing rows for this state
+        coreData: if false, don't embed each batch's coreData rows
+        view: ``full`` (the default) or ``summary``, see ``batch_summary_query``
+    """
+    config = flask.current_app.config
+    after = _get_batches_arg('after', int)
+    limit = _get_batches_arg('limit', inputs.positive)
+    if limit is not None or after is not None:
+        limit = min(limit or config.get('BATCHES_PAGE_SIZE', 100),
+                    config.get('BATCHES_MAX_PAGE_SIZE', 1000))
+    is_published = _get_batches_arg('isPublished', inputs.boolean)
+    data_entry_type = flask.request.args.get('dataEntryType')
+    state = flask.request.args.get('state')
+    include_core_data = _get_batches_arg('coreData', inputs.boolean, True)
+    view = _get_batches_view()
+    flask.current_app.logger.info('Retrieving batches: %s' % flask.request.args.to_dict())
+
+    if view == 'summary':
+        query = batch_summary_query()
+    else:
+        # compute the changed dates in SQL, so they don't require the coreData rows
+        query = db.session.query(Batch, Batch.changedDatesMin, Batch.changedDatesMax)
+        if include_core_data:
+            # load the coreData rows of all the batches (and their states, for totalTestResults)
+            # with a constant number of queries instead of one per batch
+            query = query.options(selectinload(Batch.coreData).selectinload(CoreData.state_obj))
+
+    if after is not None:
+        query = query.filter(Batch.batchId > after)
+    if is_published is not None:
+        query = query.filter(Batch.isPublished == is_published)
+    if data_entry_type:
+        query = query.filter(Batch.dataEntryType == data_entry_type)
+    if state:
+        query = query.filter(Batch.coreData.any(CoreData.state == state.upper()))
+    query = query.order_by(Batch.batchId)
+    if limit is not None:
+        query = query.limit(limit)
+
+    if view == 'summary':
+        return make_json_array_response(
+            (batch_summary_to_dict(row) for row in query.yield_per(STREAM_BATCH_SIZE)),
+            key='batches')
+
+    batches = Batch.with_changed_dates(query.yield_per(STREAM_BATCH_SIZE))
+    return make_json_array_response(
+        (batch.to_dict(include_core_data=include_core_data) for batch in batches), key='batches')
 
 
 @api.route('/batches/<int:id>', methods=['GET'])
 def get_batch_by_id(id):
+    if _get_batches_view() == 'summary':
+        row = batch_summary_query().filter(Batch.batchId == id).first()
+        if row is None:
+            flask.abort(404)
+        flask.current_app.logger.info('Returning batch %d summary' % id)
+        return flask.jsonify(batch_summary_to_dict(row))
+
     batch = Batch.query.get_or_404(id)
     flask.current_app.logger.info('Returning batch %d' % id)
     return flask.jsonify(batch.to_dict())
 
 
 @api.route('/batches/<int:id>/publish', methods=['POST'])
+@statement_timeout('DB_INGEST_STATEMENT_TIMEOUT')
 @jwt_required
 @notify_webhook
 @exceptions_to_slack
@@ -71,7 +182,10 @@ def publish_batch(id):
     batch.isPublished = True
     batch.publishedAt = datetime.utcnow()   # set publish time to now
     db.session.add(batch)
+    db.session.flush()
+    update_latest_core_data(batch.batchId)
     db.session.commit()
+    bump_data_generation()
 
     notify_slack(f"*Published batch #{id}* (type: {batch.dataEntryType})\n"
                  f"{batch.batchNote}")
@@ -84,7 +198,66 @@ def publish_batch(id):
 ##############################################################################################
 
 
+def existing_state_pks(state_pks):
+    """Return the set of the states in ``state_pks`` that exist"""
+    return {row.state for row in db.session.query(State.state).filter(State.state.in_(set(state_pks)))}
+
+
+def upsert_states(state_dicts, existing_states):
+    """Create or update all the states in ``state_dicts`` with INSERT ... ON CONFLICT statements.
+
+    Only the fields present in the state dicts are written: other fields keep their current value,
+    so concurrent edits to other fields of the same state aren't reverted. If a state appears more
+    than once, later dicts override earlier ones. States with the same set of fields are written
+    with a single statement.
+
+    Args:
+        state_dicts: list of dicts of state fields, each containing at least the ``state`` key
+        existing_states: the states that already exist, from ``existing_state_pks``
+
+    Returns:
+        list: the JSON representation of the written states, one per input state dict
+    """
+    column_names = set(State.__table__.columns.keys())
+    rows = {}
+    for state_dict in state_dicts:
+        rows.setdefault(state_dict['state'], {}).update(
+            (k, v) for k, v in state_dict.items() if k in column_names)
+
+    # this method of writing does not trigger validators, so validate manually
+    for state_pk, row in rows.items():
+        if state_pk not in existing_states or 'totalTestResultsFieldDbColumn' in row:
+            State.validate_totalTestResultsFieldDbColumn(
+                None, 'totalTestResultsFieldDbColumn', row.get('totalTestResultsFieldDbColumn'))
+
+    rows_by_fields = collections.defaultdict(list)
+    for row in rows.values():
+        rows_by_fields[tuple(sorted(row))].append(row)
+
+    written = {}
+    for fields, field_rows in rows_by_fields.items():
+        if 'totalTestResultsFieldDbColumn' not in fields:
+            # the proposed rows must pass the NOT NULL check even when they conflict: this is
+            # never written, as only existing states can leave it out and only given fields are set
+            field_rows = [dict(row, totalTestResultsFieldDbColumn='posNeg') for row in field_rows]
+        stmt = insert(State.__table__).values(field_rows)
+        updated_fields = [name for name in fields if name != 'state']
+        if updated_fields:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['state'],
+                set_={name: stmt.excluded[name] for name in updated_fields})
+        else:
+            # nothing to update, but the existing row must still be returned
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['state'], set_={'state': stmt.excluded.state})
+        stmt = stmt.returning(*State.__table__.columns)
+        written.update((row.state, State.row_to_dict(row)) for row in db.session.execute(stmt))
+
+    return [written[state_dict['state']] for state_dict in state_dicts]
+
+
 @api.route('/states/edit', methods=['POST'])
+@statement_timeout('DB_INGEST_STATEMENT_TIMEOUT')
 @jwt_required
 @notify_webhook
 @exceptions_to_slack
@@ -100,31 +273,22 @@ def edit_state_metadata():
         return err, 400
 
     state_dicts = payload['states']
-    state_objects = []
+    existing_states = existing_state_pks(state_dict['state'] for state_dict in state_dicts)
     for state_dict in state_dicts:
         state_pk = state_dict['state']
-        state_obj = db.session.query(State).get(state_pk)
-        if state_obj is None:
+        if state_pk not in existing_states:
             err = '/states/edit payload trying to edit nonexistent state: %s' % state_pk
             flask.current_app.logger.error(err)
             notify_slack_error(err, 'edit_state_metadata')
             return err, 400
 
-        flask.current_app.logger.info('Updating state row from info: %s' % state_dict)
-        db.session.query(State).filter_by(state=state_pk).update(state_dict)
-        # this method of updating does not trigger validators, so validate manually
-        state_obj.validate_totalTestResultsFieldDbColumn(None, state_obj.totalTestResultsFieldDbColumn)
-        state_objects.append(db.session.query(State).get(state_pk))  # return updated state
-
-    db.session.flush()
-
-    # construct the JSON before committing the session, since sqlalchemy objects behave weirdly
-    # once the session has been committed
+    flask.current_app.logger.info('Updating state rows from info: %s' % state_dicts)
     json_to_return = {
-        'states': [state.to_dict() for state in state_objects],
+        'states': upsert_states(state_dicts, existing_states),
     }
 
     db.session.commit()
+    bump_data_generation()
 
     # this returns a tuple of flask response and status code: (flask.Response, int)
     return flask.jsonify(json_to_return), 201
@@ -134,6 +298,20 @@ def edit_state_metadata():
 ######################################   Core data      ######################################
 ##############################################################################################
 
+def core_data_rows_json(core_data_rows):
+    """Serialize core data rows written from column value dicts, without loading them back.
+
+    totalTestResults is computed using the current totalTestResults source of each row's state.
+    """
+    total_test_results_sources = dict(db.session.query(
+        State.state, State.totalTestResultsFieldDbColumn).filter(
+        State.state.in_({row['state'] for row in core_data_rows})))
+    return [
+        CoreData.row_to_dict(SimpleNamespace(
+            totalTestResultsSource=total_test_results_sources[row['state']], **row))
+        for row in core_data_rows]
+
+
 # Expects a dictionary of push context, state info, and core data rows. Writes to DB.
 def post_core_data_json(payload):
     # test the input data
@@ -152,53 +330,42 @@ def post_core_data_json(payload):
     db.session.add(batch)
     db.session.flush()  # this sets the batch ID, which we need for corresponding coreData objects
 
-    # add states
+    # add or update states
     state_dicts = payload['states']
-    state_objects = []
-    for state_dict in state_dicts:
-        state_pk = state_dict['state']
-        state_obj = db.session.query(State).get(state_pk)
-        if state_obj is not None:
-            flask.current_app.logger.info('Updating state row from info: %s' % state_dict)
-            db.session.query(State).filter_by(state=state_pk).update(state_dict)
-            # this method of updating does not trigger validators, so validate manually
-            state_obj.validate_totalTestResultsFieldDbColumn(None, state_obj.totalTestResultsFieldDbColumn)
-            state_objects.append(state_obj)  # return updated state
-        else:
-            flask.current_app.logger.info('Creating new state row from info: %s' % state_dict)
-            state = State(**state_dict)
-            db.session.add(state)
-            state_objects.append(state)
-
-        db.session.flush()
+    flask.current_app.logger.info('Creating or updating state rows from info: %s' % state_dicts)
+    states_json = upsert_states(
+        state_dicts, existing_state_pks(state_dict['state'] for state_dict in state_dicts))
 
-    # add all core data rows
+    # add all core data rows: normalize them all in one pass, then write them with a single bulk
+    # INSERT instead of going through the session's unit of work one object at a time
     core_data_dicts = payload['coreData']
-    core_data_objects = []
+    flask.current_app.logger.info('Creating %d new core data rows' % len(core_data_dicts))
+    core_data_rows = []
     for core_data_dict in core_data_dicts:
-        flask.current_app.logger.info('Creating new core data row: %s' % core_data_dict)
         core_data_dict['batchId'] = batch.batchId
-        core_data = CoreData(**core_data_dict)
-        db.session.add(core_data)
-        core_data_objects.append(core_data)
+        core_data_rows.append(CoreData.column_values(core_data_dict))
+    db.session.execute(CoreData.__table__.insert(), core_data_rows)
 
-    db.session.flush()
+    if batch.isPublished:
+        update_latest_core_data(batch.batchId)
 
     # construct the JSON before committing the session, since sqlalchemy objects behave weirdly
     # once the session has been committed
     json_to_return = {
         'batch': batch.to_dict(),
-        'coreData': [core_data.to_dict() for core_data in core_data_objects],
-        'states': [state.to_dict() for state in state_objects],
+        'coreData': core_data_rows_json(core_data_rows),
+        'states': states_json,
     }
 
     db.session.commit()
+    bump_data_generation()
 
     # this returns a tuple of flask response and status code: (flask.Response, int)
     return flask.jsonify(json_to_return), 201
 
 
 @api.route('/batches', methods=['POST'])
+@statement_timeout('DB_INGEST_STATEMENT_TIMEOUT')
 @jwt_required
 @exceptions_to_slack
 def post_core_data():
@@ -222,14 +389,11 @@ def post_core_data():
 
 def any_existing_rows(state, date):
     date = CoreData.parse_str_to_date(date)
-    existing_rows = db.session.query(CoreData).join(Batch).filter(
-        Batch.isPublished == True,
-        CoreData.state == state,
-        CoreData.date == date).all()
-    return len(existing_rows) > 0
+    return published_state_date_query(state, date).first() is not None
 
 
 @api.route('/batches/edit', methods=['POST'])
+@statement_timeout('DB_INGEST_STATEMENT_TIMEOUT')
 @jwt_required
 @notify_webhook
 @exceptions_to_slack
@@ -251,6 +415,7 @@ def edit_core_data():
 
 
 @api.route('/batches/edit_states_daily', methods=['POST'])
+@statement_timeout('DB_INGEST_STATEMENT_TIMEOUT')
 @jwt_required
 @notify_webhook
 @exceptions_to_slack
@@ -293,19 +458,8 @@ def edit_states_daily_internal(user, context, core_data, state_to_edit=None, pub
     db.session.add(batch)
     db.session.flush()  # this sets the batch ID, which we need for corresponding coreData objects
 
-    latest_daily_data_for_state = states_daily_query(state=state_to_edit).all()
-
-    # split up by date for easier lookup/comparison with input edit rows
-    date_to_data = {}
-    for state_daily_data in latest_daily_data_for_state:
-        date_to_data[state_daily_data.date] = state_daily_data
-
-    # keep track of all our changes as we go
-    core_data_objects = []
-    changed_rows = []
-    new_rows = []
-
-    # check each core data row that the corresponding date/state already exists in published form
+    # validate the input rows first, and collect the dates and states they touch
+    edit_dicts = []
     for core_data_dict in core_data:
         # this state has to be identical to the state from the context
         state = core_data_dict['state']
@@ -326,12 +480,33 @@ def edit_states_daily_internal(user, context, core_data, state_to_edit=None, pub
             flask.current_app.logger.warning('Got row with unknown field updates: %s. %r' % (
                 unknown, core_data_dict))
 
+        core_data_dict['batchId'] = batch.batchId
+        edit_dicts.append((CoreData.parse_str_to_date(core_data_dict['date']), core_data_dict))
+
+    # only fetch the current published rows for the edited (state, date) pairs, in one query
+    latest_daily_data_query = states_daily_query(
+        state=state_to_edit, dates={date for date, _ in edit_dicts})
+    if not state_to_edit:
+        latest_daily_data_query = latest_daily_data_query.filter(
+            CoreData.state.in_({core_data_dict['state'] for _, core_data_dict in edit_dicts}))
+
+    # split up by state and date for easier lookup/comparison with input edit rows
+    key_to_data = {}
+    for state_daily_data in latest_daily_data_query:
+        key_to_data[(state_daily_data.state, state_daily_data.date)] = state_daily_data
+
+    # keep track of all our changes as we go: compute every diff in memory, then write all the
+    # new revision rows at once
+    core_data_rows = []
+    changed_rows = []
+    new_rows = []
+
+    # check each core data row that the corresponding date/state already exists in published form
+    for date, core_data_dict in edit_dicts:
         # is there a date for this?
         # check that there exists at least one published row for this date/state
-        date = CoreData.parse_str_to_date(core_data_dict['date'])
-        data_for_date = date_to_data.get(date)
-        core_data_dict['batchId'] = batch.batchId
-        edited_core_data = None
+        data_for_date = key_to_data.get((core_data_dict['state'], date))
+        edited_row = None
 
         if not data_for_date:
             # this is a new row: we treat this as a changed date
@@ -342,27 +517,27 @@ def edit_states_daily_internal(user, context, core_data, state_to_edit=None, pub
             # return flask.jsonify(error), 400
 
             flask.current_app.logger.info('Row for date not found, making new edit row: %s' % date)
-            edited_core_data = CoreData(**core_data_dict)
-            new_rows.append(edited_core_data)
+            edited_row = CoreData.column_values(core_data_dict)
+            new_rows.append(SimpleNamespace(**edited_row))
         else:
             # this row already exists, but check each value to see if anything changed. Easiest way
-            changed_for_date = data_for_date.field_diffs(core_data_dict)
+            fields = CoreData.normalized_fields(core_data_dict)
+            changed_for_date = data_for_date.diff_fields(fields)
             if changed_for_date:
                 changed_rows.append(changed_for_date)
-                edited_core_data = data_for_date.copy_with_updates(**core_data_dict)
+                edited_row = data_for_date.updated_values(fields)
 
         # if any value in the row is different, make an edit batch
-        if edited_core_data:
+        if edited_row:
             # store the changes
-            db.session.add(edited_core_data)
-            core_data_objects.append(edited_core_data)
-            db.session.flush()
-            flask.current_app.logger.info('Adding new edit row: %s' % edited_core_data.to_dict())
+            core_data_rows.append(edited_row)
+            flask.current_app.logger.info('Adding new edit row: %s' % edited_row)
         else:
             # there were no changes
             flask.current_app.logger.info('All values are the same for date %s, ignoring' % date)
 
-    db.session.flush()
+    if core_data_rows:
+        db.session.execute(CoreData.__table__.insert(), core_data_rows)
 
     diffs = EditDiff(changed_rows, new_rows)
     if diffs.is_empty():
@@ -376,6 +551,8 @@ def edit_states_daily_internal(user, context, core_data, state_to_edit=None, pub
     batch.changedFields = diffs.changed_fields
     batch.numRowsEdited = diffs.size()
     db.session.flush()
+    if publish:
+        update_latest_core_data(batch.batchId)
 
     # TODO: change consumer of this response to use the changedFields, changedDates, numRowsEdited
     # from the "batch" object, then remove those keys from the JSON response
@@ -385,10 +562,11 @@ def edit_states_daily_internal(user, context, core_data, state_to_edit=None, pub
         'changedDates': diffs.changed_dates_str,
         'numRowsEdited': batch.numRowsEdited,
         'user': get_jwt_identity(),
-        'coreData': [core_data.to_dict() for core_data in core_data_objects],
+        'coreData': core_data_rows_json(core_data_rows),
     }
 
     db.session.commit()
+    bump_data_generation()
 
     # collect all the diffs for the edits we've made and format them for a slack notification
     diffs_for_slack = diffs.plain_text_format()
@@ -405,17 +583,13 @@ def edit_states_daily_internal(user, context, core_data, state_to_edit=None, pub
 def get_state_date_history(state, date):
     flask.current_app.logger.info('Retrieving state date history')
 
-    history = db.session.query(CoreData).join(Batch).filter(
-        Batch.isPublished == True,
-        CoreData.state == state.upper(),
-        CoreData.date == date
-        ).order_by(CoreData.batchId.desc()).all()
+    history = state_date_history_query(state.upper(), date)
 
     return_history = []
-    for elem in history:
+    for elem, changed_dates_min, changed_dates_max in history:
+        elem.batch._changed_dates = (changed_dates_min, changed_dates_max)
         return_elem = elem.to_dict()
-        return_elem['batch'] = elem.batch.to_dict()
-        del return_elem['batch']['coreData']
+        return_elem['batch'] = elem.batch.to_dict(include_core_data=False)
         return_history.append(return_elem)
 
     return flask.jsonify(return_history)
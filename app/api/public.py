@@ -1,15 +1,23 @@
 """Registers the necessary routes for the public API endpoints."""
 
+import itertools
+
 import flask
 from flask import request
 from flask_restful import inputs
 
 from app.api import api
-from app.api.common import states_daily_query, us_daily_query
+from app.api.common import states_daily_rows_query, us_daily_query, make_json_array_response, \
+    STREAM_BATCH_SIZE
 from app.models.data import *
+from app.utils.cache import cached_response, conditional_response
+from app.utils.database import statement_timeout
 
 
 @api.route('/public/states/info', methods=['GET'])
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_states():
     states = State.query.order_by(State.state.asc()).all()
     return flask.jsonify(
@@ -18,30 +26,41 @@ def get_states():
 
 
 @api.route('/public/states/daily', methods=['GET'])
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_states_daily():
     flask.current_app.logger.info('Retrieving States Daily')
     include_preview = request.args.get('preview', default=False, type=inputs.boolean)
-    latest_daily_data = states_daily_query(preview=include_preview).all()
-    return flask.jsonify([x.to_dict() for x in latest_daily_data])
+    latest_daily_data = states_daily_rows_query(preview=include_preview).yield_per(STREAM_BATCH_SIZE)
+    return make_json_array_response(CoreData.row_to_dict(x) for x in latest_daily_data)
 
 
 @api.route('/public/states/<string:state>/daily', methods=['GET'])
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_states_daily_for_state(state):
     flask.current_app.logger.info('Retrieving States Daily for state %s' % state)
     include_preview = request.args.get('preview', default=False, type=inputs.boolean)
-    latest_daily_data_for_state = states_daily_query(
-        state=state.upper(), preview=include_preview).all()
-    if len(latest_daily_data_for_state) == 0:
+    latest_daily_data_for_state = iter(states_daily_rows_query(
+        state=state.upper(), preview=include_preview).yield_per(STREAM_BATCH_SIZE))
+    first = next(latest_daily_data_for_state, None)
+    if first is None:
         # likely state not found
         return flask.Response("States Daily data unavailable for state %s" % state, status=404)
 
-    return flask.jsonify([x.to_dict() for x in latest_daily_data_for_state])
+    return make_json_array_response(
+        CoreData.row_to_dict(x) for x in itertools.chain([first], latest_daily_data_for_state))
 
 
 @api.route('/public/us/daily', methods=['GET'])
+@statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')
+@conditional_response
+@cached_response
 def get_us_daily():
     flask.current_app.logger.info('Retrieving US Daily')
     include_preview = request.args.get('preview', default=False, type=inputs.boolean)
     us_data_by_date = us_daily_query(preview=include_preview)
 
-    return flask.jsonify(us_data_by_date)
+    return make_json_array_response(us_data_by_date)
@@ -0,0 +1,337 @@
+"""ASGI serving mode for the read-only public API.
+
+Serves the ``/public/*`` routes of ``app/api/public.py`` and ``app/api/csv.py`` on asyncio, reading
+from Postgres through an asyncpg connection pool. A slow client or a slow query then only holds a
+coroutine and a pooled connection, instead of a whole sync worker. Run it with an ASGI server, e.g.:
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi_server:app
+
+The output is byte-identical to the Flask routes: URLs are matched with the Flask app's URL map, the
+SQL is compiled from the same query builders and rows are serialized by the same functions. ETags are
+the same too, and responses are cached until the data generation changes, like the Flask routes.
+"""
+import asyncio
+import collections
+import re
+from urllib.parse import parse_qsl
+
+import asyncpg
+import flask
+from flask_restful import inputs
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+from app.api.common import states_daily_rows_query, us_daily_rows_query, format_us_daily, \
+    json_array_chunks, STREAM_BATCH_SIZE
+from app.api.csv import csv_chunks, reformat_states_daily, states_daily_csv_columns, \
+    us_daily_csv_columns, STATES_INFO_COLUMNS
+from app.models.data import CoreData, State
+from app.utils.cache import DATA_VERSION_SQL, BodyBuffer, DataVersion, response_etag, \
+    response_last_modified, last_modified_header, is_not_modified
+
+
+# Queries are compiled with psycopg2's %(name)s placeholders, rewritten to asyncpg's $1: the numeric
+# paramstyle can't render the values of expanding parameters (e.g. IN lists) with SQLAlchemy 1.4
+_DIALECT = postgresql.dialect()
+_NAMED_PARAM = re.compile(r'%\(([^)]+)\)s|%%')
+
+
+class Statement:
+    """A SQLAlchemy query compiled for asyncpg.
+
+    The query's bound values are used as the statement arguments, unless given by name to ``args``.
+    """
+
+    def __init__(self, query):
+        compiled = query.statement.compile(
+            dialect=_DIALECT, compile_kwargs={'render_postcompile': True})
+        self.names = []
+        self.sql = _NAMED_PARAM.sub(self._placeholder, str(compiled))
+        self.params = compiled.params
+
+    def _placeholder(self, match):
+        name = match.group(1)
+        if name is None:  # an escaped %
+            return '%'
+        if name not in self.names:
+            self.names.append(name)
+        return '$%d' % (self.names.index(name) + 1)
+
+    def args(self, **values):
+        return [values[name] if name in values else self.params[name] for name in self.names]
+
+
+def _rows(records):
+    """Return asyncpg records as named tuples, which the serializers read like query result rows"""
+    if not records:
+        return []
+    row_type = collections.namedtuple('Row', records[0].keys())
+    return [row_type(*record) for record in records]
+
+
+def _boolean_arg(args, name):
+    try:
+        return inputs.boolean(args[name]) if name in args else False
+    except ValueError:
+        return False
+
+
+class PublicAPI:
+    """ASGI application serving the public read API of a Flask app.
+
+    The Flask app provides the configuration, the URL map, JSON encoding and the response cache. Its
+    database session is only used to compile the queries, once, when this is created.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.url_map = flask_app.url_map
+        self.cache = flask_app.extensions['response_cache']
+        self.dsn = re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://',
+                          flask_app.config['SQLALCHEMY_DATABASE_URI'])
+        self.pool_min_size = flask_app.config.get('ASYNC_DB_POOL_MIN_SIZE', 1)
+        self.pool_max_size = flask_app.config.get('ASYNC_DB_POOL_MAX_SIZE', 10)
+        # only public reads are served: every connection gets their statement timeout
+        self.server_settings = {
+            'application_name': '%s:asgi' % flask_app.config.get(
+                'DB_APPLICATION_NAME', 'covid-publishing-api'),
+            'statement_timeout': str(flask_app.config.get('DB_PUBLIC_STATEMENT_TIMEOUT', 10000)),
+        }
+        self._pool = None
+
+        with flask_app.app_context():
+            state = bindparam('state', None)
+            self.states_info_statement = Statement(State.query.order_by(State.state.asc()))
+            self.states_daily_statements = {
+                preview: Statement(states_daily_rows_query(preview=preview))
+                for preview in (False, True)}
+            self.state_daily_statements = {
+                preview: Statement(states_daily_rows_query(state=state, preview=preview))
+                for preview in (False, True)}
+            self.us_daily_statements = {
+                preview: Statement(us_daily_rows_query(preview=preview))
+                for preview in (False, True)}
+
+        self.views = {
+            'api.get_states': self.get_states,
+            'api.get_states_csv': self.get_states_csv,
+            'api.get_states_daily': self.get_states_daily,
+            'api.get_states_daily_for_state': self.get_states_daily_for_state,
+            'api.get_us_daily': self.get_us_daily,
+            'api.states_daily': self.get_states_daily_csv,
+            'api.states_current': self.get_states_daily_csv,
+            'api.us_daily': self.get_us_daily_csv,
+            'api.us_current': self.get_us_daily_csv,
+        }
+
+    async def pool(self):
+        """Return the connection pool, created on first use"""
+        if self._pool is None:
+            self._pool = asyncio.ensure_future(asyncpg.create_pool(
+                self.dsn, min_size=self.pool_min_size, max_size=self.pool_max_size,
+                server_settings=self.server_settings))
+        return await self._pool
+
+    async def close(self):
+        if self._pool is not None:
+            pool = await self._pool
+            self._pool = None
+            await pool.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.pool()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, send):
+        adapter = self.url_map.bind('localhost', script_name=scope.get('root_path') or None)
+        try:
+            endpoint, view_args = adapter.match(scope['path'], method=scope['method'])
+            if endpoint not in self.views:
+                raise NotFound()
+        except HTTPException as e:
+            response = e.get_response()
+            await self.send_response(send, response.status_code, response.headers.items(),
+                                     [response.get_data()])
+            return
+
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        arg_items = parse_qsl(query_string, keep_blank_values=True)
+        args = {}
+        for name, value in arg_items:
+            args.setdefault(name, value)
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                   for name, value in scope.get('headers', [])}
+        head_only = scope['method'] == 'HEAD'
+
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            version = DataVersion(*await conn.fetchrow(DATA_VERSION_SQL))
+            etag = response_etag(endpoint, view_args, arg_items, version)
+            last_modified = response_last_modified(version, args)
+            validators = [('ETag', quote_etag(etag))]
+            if last_modified is not None:
+                validators.append(('Last-Modified', http_date(last_modified_header(last_modified))))
+
+            if is_not_modified(etag, last_modified,
+                               parse_etags(headers.get('if-none-match')),
+                               parse_date(headers.get('if-modified-since'))):
+                await self.send_response(send, 304, validators, [])
+                return
+
+            key = (endpoint, tuple(sorted(view_args.items())), tuple(sorted(arg_items)),
+                   version.generation)
+            cached = self.cache.get(key) if self.cache.max_size > 0 else None
+            if cached is not None:
+                # like the Flask routes, the validators are not cached but added to each response
+                body, status, cached_headers = cached
+                await self.send_response(send, status, list(cached_headers) + validators, [body],
+                                         head_only)
+                return
+
+            # cursors only live within a transaction
+            async with conn.transaction():
+                output = self.views[endpoint](conn, endpoint, view_args, args)
+                status, content_type = await output.__anext__()
+                response_headers = [('Content-Type', content_type)]
+                if status != 200:
+                    await self.send_response(send, status, response_headers,
+                                             [chunk async for chunk in output], head_only)
+                    return
+                # the length of a streamed response isn't known up front
+                await send({'type': 'http.response.start', 'status': status,
+                            'headers': _encode_headers(response_headers + validators)})
+                if head_only:
+                    await output.aclose()
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                # like the Flask routes, only keep the body for the cache if it isn't too large
+                buffer = BodyBuffer(self.cache.max_entry_size) if self.cache.max_size > 0 else None
+                async for chunk in output:
+                    chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                    if buffer is not None:
+                        buffer.append(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b''})
+
+        if buffer is not None and buffer.body is not None:
+            self.cache.set(key, (buffer.body, status, response_headers))
+
+    async def send_response(self, send, status, headers, chunks, head_only=False):
+        """Send a whole response at once, only its headers for a HEAD request"""
+        body = b''.join(chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                        for chunk in chunks)
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        headers.append(('Content-Length', str(len(body))))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': _encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': b'' if head_only else body})
+
+    async def fetch_batches(self, conn, statement, **values):
+        """Yield the rows of a statement in batches of ``STREAM_BATCH_SIZE``, from a cursor"""
+        cursor = await conn.cursor(statement.sql, *statement.args(**values))
+        while True:
+            rows = _rows(await cursor.fetch(STREAM_BATCH_SIZE))
+            if not rows:
+                return
+            yield rows
+
+    def json_chunk(self, items, first, last):
+        # JSON is encoded by the Flask app. The context is pushed and popped without awaiting in
+        # between, so it can't leak into the other requests handled meanwhile.
+        with self.flask_app.app_context():
+            return ''.join(json_array_chunks(items, first=first, last=last))
+
+    # Views: async generators yielding the (status, content type) of the response, then its body
+
+    async def get_states(self, conn, endpoint, view_args, args):
+        rows = _rows(await conn.fetch(self.states_info_statement.sql,
+                                      *self.states_info_statement.args()))
+        with self.flask_app.app_context():
+            response = flask.jsonify([State.row_to_dict(row) for row in rows])
+        yield response.status_code, response.headers['Content-Type']
+        yield response.get_data()
+
+    async def get_states_csv(self, conn, endpoint, view_args, args):
+        rows = _rows(await conn.fetch(self.states_info_statement.sql,
+                                      *self.states_info_statement.args()))
+        yield 200, 'text/csv'
+        yield ''.join(csv_chunks(STATES_INFO_COLUMNS, rows))
+
+    async def get_states_daily(self, conn, endpoint, view_args, args):
+        statement = self.states_daily_statements[_boolean_arg(args, 'preview')]
+        yield 200, 'application/json'
+        first = True
+        async for rows in self.fetch_batches(conn, statement):
+            yield self.json_chunk((CoreData.row_to_dict(row) for row in rows), first, False)
+            first = False
+        yield self.json_chunk([], first, True)
+
+    async def get_states_daily_for_state(self, conn, endpoint, view_args, args):
+        state = view_args['state']
+        statement = self.state_daily_statements[_boolean_arg(args, 'preview')]
+        batches = self.fetch_batches(conn, statement, state=state.upper())
+        try:
+            rows = await batches.__anext__()
+        except StopAsyncIteration:
+            # likely state not found
+            yield 404, 'text/html; charset=utf-8'
+            yield "States Daily data unavailable for state %s" % state
+            return
+        yield 200, 'application/json'
+        yield self.json_chunk((CoreData.row_to_dict(row) for row in rows), True, False)
+        async for rows in batches:
+            yield self.json_chunk((CoreData.row_to_dict(row) for row in rows), False, False)
+        yield self.json_chunk([], False, True)
+
+    async def get_us_daily(self, conn, endpoint, view_args, args):
+        statement = self.us_daily_statements[_boolean_arg(args, 'preview')]
+        us_daily = format_us_daily([dict(record) for record in
+                                    await conn.fetch(statement.sql, *statement.args())])
+        yield 200, 'application/json'
+        yield self.json_chunk(us_daily, True, True)
+
+    async def get_states_daily_csv(self, conn, endpoint, view_args, args):
+        statement = self.states_daily_statements[_boolean_arg(args, 'preview')]
+        columns = states_daily_csv_columns(endpoint)
+        current_only = endpoint == 'api.states_current'
+        # latest date of each state, carried over the batches for the current endpoint
+        state_latest_dates = {}
+        yield 200, 'text/csv'
+        header = True
+        async for rows in self.fetch_batches(conn, statement):
+            yield ''.join(csv_chunks(
+                columns, reformat_states_daily(rows, current_only, state_latest_dates), header))
+            header = False
+        if header:
+            yield ''.join(csv_chunks(columns, []))
+
+    async def get_us_daily_csv(self, conn, endpoint, view_args, args):
+        statement = self.us_daily_statements[_boolean_arg(args, 'preview')]
+        us_daily = format_us_daily([dict(record) for record in
+                                    await conn.fetch(statement.sql, *statement.args())],
+                                   date_format='%Y%m%d')
+        # the /current endpoint only returns the latest data instead of all dates
+        if endpoint == 'api.us_current':
+            us_daily = us_daily[:1]
+        yield 200, 'text/csv'
+        yield ''.join(csv_chunks(us_daily_csv_columns(endpoint), us_daily))
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+            for name, value in headers]
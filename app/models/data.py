@@ -1,34 +1,96 @@
 import csv
 from datetime import datetime, date
-from dateutil import parser
+from dateutil import parser, tz
 import os
 import pytz
 
 from app import db
 from app.utils.editdiff import EditDiff, ChangedValue, ChangedRow
+from app.utils.timeformat import format_eastern, format_utc
 import logging
+import operator
+import re
 
+from sqlalchemy import and_, case, func, select
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import class_mapper, relationship, validates
 
 
+# Counter bumped on every data write, used to version cached responses (see app/utils/cache.py)
+data_generation = db.Sequence('dataGeneration', metadata=db.metadata)
+
+
+_MISSING = object()
+
+# input formats parsed without going through dateutil, see CoreData.parse_str_to_date and
+# CoreData._match_iso_datetime
+_DATE_RE = re.compile(r'(\d{4})(-?)(\d{2})\2(\d{2})$')
+_ISO_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?(Z|[+-]\d{2}:?\d{2})$')
+_TZ_UTC = tz.tzutc()
+
+
 class DataMixin(object):
 
+    # (columns, hybrids) serialization recipe, generated once per model by compile_serializer:
+    # columns is a tuple of (name, getter, repr function), hybrids a tuple of (name, getter)
+    _serializer = None
+
+    @classmethod
+    def compile_serializer(cls):
+        """Precompute what ``to_dict`` outputs for this model, so that serializing a row doesn't
+        have to introspect the table columns and ORM descriptors every time."""
+        columns = tuple(
+            (column.name, operator.attrgetter(column.name), column.info.get("repr"))
+            for column in cls.__table__.columns)
+        hybrids = tuple(
+            (key, prop.fget) for key, prop in inspect(cls).all_orm_descriptors.items()
+            if isinstance(prop, hybrid_property))
+        cls._serializer = (columns, hybrids)
+        cls._column_names = tuple(column.name for column in cls.__table__.columns)
+        # returns a row's column values as a tuple, in column order
+        cls._row_values = operator.attrgetter(*cls._column_names)
+
     def to_dict(self):
+        columns, hybrids = self._serializer
+        # loaded column values live in the instance dict, reading them from there skips the ORM
+        # attribute machinery. Anything else (e.g. expired attributes) goes through the getter.
+        loaded = self.__dict__
         d = {}
         # get column attributes, skip any nulls
-        for column in self.__table__.columns:
-            repr_fn = column.info.get("repr")
-            attr = getattr(self, column.name)
+        for name, getter, repr_fn in columns:
+            attr = loaded[name] if name in loaded else getter(self)
             if attr is not None:
                 if repr_fn is not None:
                     attr = repr_fn(attr)
-                d[column.name] = attr
+                d[name] = attr
         # get derived fields (hybrid_property)
-        for key, prop in inspect(self.__class__).all_orm_descriptors.items():
-            if isinstance(prop, hybrid_property):
-                d[key] = getattr(self, key)
+        for name, fget in hybrids:
+            d[name] = fget(self)
+
+        return d
+
+    @classmethod
+    def row_to_dict(cls, row):
+        """Serialize a row of plain column values exactly like ``to_dict`` serializes a model object.
+
+        ``row`` is any object exposing this model's columns as attributes, typically a query result
+        row selecting the model's columns, so serializing doesn't require hydrating ORM objects.
+        Derived fields are computed from the row, unless the row provides them itself: e.g. a
+        CoreData row has to provide ``totalTestResultsSource``, selected from the joined state.
+        """
+        columns, hybrids = cls._serializer
+        d = {}
+        for name, getter, repr_fn in columns:
+            attr = getter(row)
+            if attr is not None:
+                if repr_fn is not None:
+                    attr = repr_fn(attr)
+                d[name] = attr
+        for name, fget in hybrids:
+            value = getattr(row, name, _MISSING)
+            d[name] = fget(row) if value is _MISSING else value
 
         return d
 
@@ -61,18 +123,53 @@ class Batch(db.Model, DataMixin):
 
     coreData = relationship('CoreData', backref='batch')
 
+    # (min, max) date of the batch's coreData rows, when selected in SQL along with the batch, see
+    # with_changed_dates. Not a mapped attribute
+    _changed_dates = None
+
     @hybrid_property
     def changedDatesMin(self):
+        if self._changed_dates is not None:
+            return self._changed_dates[0]
         if not self.coreData:
             return None
         return min(d.date for d in self.coreData)
 
+    # the changed dates are computed over all the coreData rows of the batch, even when the outer
+    # query selects from coreData too (e.g. state date history): only batches is correlated
+    @changedDatesMin.expression
+    def changedDatesMin(cls):
+        return select(func.min(CoreData.date)).where(
+            CoreData.batchId == cls.batchId).correlate_except(CoreData).label('changedDatesMin')
+
     @hybrid_property
     def changedDatesMax(self):
+        if self._changed_dates is not None:
+            return self._changed_dates[1]
         if not self.coreData:
             return None
         return max(d.date for d in self.coreData)
 
+    @changedDatesMax.expression
+    def changedDatesMax(cls):
+        return select(func.max(CoreData.date)).where(
+            CoreData.batchId == cls.batchId).correlate_except(CoreData).label('changedDatesMax')
+
+    @staticmethod
+    def with_changed_dates(rows):
+        """Attach the changed dates selected in SQL to their batches.
+
+        Args:
+            rows: iterable of ``(batch, changedDatesMin, changedDatesMax)`` rows, e.g. from
+                ``db.session.query(Batch, Batch.changedDatesMin, Batch.changedDatesMax)``
+
+        Yields:
+            Batch: each batch, whose changed dates no longer require loading its coreData rows
+        """
+        for batch, changed_dates_min, changed_dates_max in rows:
+            batch._changed_dates = (changed_dates_min, changed_dates_max)
+            yield batch
+
     # This method isn't used when the object is read from the DB; only when a new one is being
     # created, as from a POST JSON payload.
     def __init__(self, **kwargs):
@@ -96,9 +193,10 @@ class Batch(db.Model, DataMixin):
         super(Batch, self).__init__(**relevant_kwargs)
 
 
-    def to_dict(self):
+    def to_dict(self, include_core_data=True):
         d = super(Batch, self).to_dict()
-        d['coreData'] = [coreData.to_dict() for coreData in self.coreData]
+        if include_core_data:
+            d['coreData'] = [coreData.to_dict() for coreData in self.coreData]
         return d
 
 
@@ -224,9 +322,9 @@ class CoreData(db.Model, DataMixin):
 
     # these are the source-of-truth time columns in UTC/GMT. String representations are in UTC.
     lastUpdateTime = db.Column(db.DateTime(timezone=True),
-        info={'repr': lambda x: x.astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ")})
+        info={'repr': format_utc})
     dateChecked = db.Column(db.DateTime(timezone=True),
-        info={'repr': lambda x: x.astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ")})
+        info={'repr': format_utc})
 
     checker = db.Column(db.String(100))
     doubleChecker = db.Column(db.String(100))
@@ -254,8 +352,7 @@ class CoreData(db.Model, DataMixin):
         # convert lastUpdateTime (UTC) to ET, return a string that matches how we're outputting
         # in the public API
         if self.lastUpdateTime is not None:
-            return self.lastUpdateTime.astimezone(pytz.timezone('US/Eastern')).strftime(
-                "%-m/%-d/%Y %H:%M")
+            return format_eastern(self.lastUpdateTime)
         else:
             return None
 
@@ -283,10 +380,45 @@ class CoreData(db.Model, DataMixin):
             value = getattr(self, column)
             return value
 
+    @classmethod
+    def total_test_results_expression(cls, columns, source):
+        """SQL expression equivalent to the ``totalTestResults`` hybrid property.
+
+        Args:
+            columns: column collection holding the CoreData columns, e.g. ``CoreData`` itself or
+                the ``.c`` collection of a subquery selecting CoreData rows
+            source: SQL expression for the state's ``totalTestResultsFieldDbColumn``
+
+        Returns:
+            A ``CASE`` expression evaluating to the total test results for each row
+        """
+        whens = [(source == 'posNeg',
+                  func.coalesce(columns.positive, 0) + func.coalesce(columns.negative, 0))]
+        whens.extend((source == colname, getattr(columns, colname)) for colname in cls.numeric_fields())
+        return case(*whens, else_=None)
+
     # Converts the input to a string and returns parsed datetime.date object
     @staticmethod
     def parse_str_to_date(date_input):
-        return parser.parse(str(date_input), ignoretz=True).date()
+        if isinstance(date_input, datetime):
+            return date_input.date()
+        if isinstance(date_input, date):
+            return date_input
+
+        # fast paths for the formats we almost always get: YYYY-MM-DD, YYYYMMDD or ISO 8601
+        # timestamps, whose date is taken as written, ignoring the timezone
+        date_str = str(date_input)
+        match = _DATE_RE.match(date_str)
+        if match:
+            try:
+                return date(int(match.group(1)), int(match.group(3)), int(match.group(4)))
+            except ValueError:
+                pass  # let dateutil decide
+        else:
+            parsed = CoreData._match_iso_datetime(date_str)
+            if parsed is not None:
+                return parsed.date()
+        return parser.parse(date_str, ignoretz=True).date()
 
     @staticmethod
     def valid_fields_checker(candidates):
@@ -318,56 +450,107 @@ class CoreData(db.Model, DataMixin):
 
         Return ChangedRow if there are changes, or None if no changes
         '''
-        diffs = []
         if not dict_other:
             return None
+        return self.diff_fields(self.normalized_fields(dict_other))
+
+    @classmethod
+    def normalized_fields(cls, kwargs):
+        ''' Return a dict of only the column fields present in kwargs, with values normalized
+        like the constructor does: empty values become None and date fields are parsed.
+        'lastUpdateIsoUtc' is accepted as an alias of 'lastUpdateTime'.
 
-        # we want to compare after all parsing is done
-        other = CoreData(**dict_other)
+        This is the representation that diff_fields and updated_values operate on, so an edit
+        row only has to be normalized once.
+        '''
+        column_index = cls._column_index
+        fields = {k: (None if v == "" else v) for k, v in kwargs.items() if k in column_index}
 
         # special casing for date aliases
         # TODO: define the ordering of expected date fields, and expectations
         # if multiple aliases for the same field exist
-        if 'lastUpdateIsoUtc' in dict_other and not 'lastUpdateTime' in dict_other:
+        if 'lastUpdateIsoUtc' in kwargs:
             # if both fields exist this is not ideal, but the object prefers 'lastUpdateTime'.
             # for now, 'lastUpdateTime' wins
-            dict_other['lastUpdateTime'] = dict_other['lastUpdateIsoUtc']
-
-        for field in CoreData.__table__.columns.keys():
-            # we expect batch IDs to be different, skip comparing those
-            if field == 'batchId':
-                continue
-            # for any other field, compare away
-            if field in dict_other and getattr(other, field) != getattr(self, field):
-                old = getattr(self, field)
-                new = getattr(other, field)
-                diffs.append(ChangedValue(field=field, old=old, new=new))
+            fields['lastUpdateTime'] = kwargs.get('lastUpdateTime') or kwargs['lastUpdateIsoUtc'] or None
+
+        if fields.get('lastUpdateTime') is not None:
+            fields['lastUpdateTime'] = cls._parse_aware_datetime(
+                fields['lastUpdateTime'], 'last update time')
+        if fields.get('dateChecked') is not None:
+            fields['dateChecked'] = cls._parse_aware_datetime(fields['dateChecked'], 'dateChecked')
+        if fields.get('date') is not None:
+            fields['date'] = cls.parse_str_to_date(fields['date'])
+        return fields
+
+    def diff_fields(self, fields):
+        ''' Like field_diffs, for fields already normalized by normalized_fields '''
+        current = self._row_values(self)
+        diffs = [
+            ChangedValue(field=field, old=current[i], new=fields[field])
+            for field, i in self._diffed_columns
+            if field in fields and fields[field] != current[i]]
 
         if diffs:
             changes = ChangedRow(date=self.date, state=self.state, changed_values=diffs)
             return changes
         return None
 
+    def updated_values(self, fields):
+        ''' Return the column values of a copy of this row with the normalized fields applied '''
+        values = dict(zip(self._column_names, self._row_values(self)))
+        values.update(fields)
+        return values
+
+    @staticmethod
+    def _match_iso_datetime(value):
+        # parse an ISO 8601 timestamp with a timezone, building the same value dateutil would.
+        # Returns None if the value isn't in that format
+        match = _ISO_DATETIME_RE.match(value)
+        if not match:
+            return None
+        year, month, day, hour, minute, second, fraction, tz_str = match.groups()
+        if tz_str == 'Z':
+            tzinfo = _TZ_UTC
+        else:
+            offset = int(tz_str[1:3]) * 3600 + int(tz_str[-2:]) * 60
+            if offset == 0:
+                tzinfo = _TZ_UTC
+            else:
+                tzinfo = tz.tzoffset(None, offset if tz_str[0] == '+' else -offset)
+        try:
+            return datetime(
+                int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+                int(fraction.ljust(6, '0')) if fraction else 0, tzinfo)
+        except ValueError:
+            return None  # let dateutil decide
+
+    @staticmethod
+    def _parse_datetime_str(value):
+        parsed = CoreData._match_iso_datetime(value)
+        if parsed is None:
+            parsed = parser.parse(value)
+        return parsed
+
+    @staticmethod
+    def _parse_aware_datetime(value, description):
+        if isinstance(value, str):
+            value = CoreData._parse_datetime_str(value)
+        if value.tzinfo is None:
+            raise ValueError('Expected a timezone with %s: %s' % (description, value))
+        return value
+
     @staticmethod
     def _cleanup_date_kwargs(kwargs):
         # accept either lastUpdateTime or lastUpdateIsoUtc as an input
         last_update_time = kwargs.get('lastUpdateTime') or kwargs.get('lastUpdateIsoUtc')
         if last_update_time:
-            if isinstance(last_update_time, str):
-                last_update_time = parser.parse(last_update_time)
-            if last_update_time.tzinfo is None:
-                raise ValueError(
-                    'Expected a timezone with last update time: %s' % last_update_time)
-            kwargs['lastUpdateTime'] = last_update_time
+            kwargs['lastUpdateTime'] = CoreData._parse_aware_datetime(
+                last_update_time, 'last update time')
 
         date_checked = kwargs.get('dateChecked')
         if date_checked:
-            if isinstance(date_checked, str):
-                date_checked = parser.parse(date_checked)
-            if date_checked.tzinfo is None:
-                raise ValueError(
-                    'Expected a timezone with dateChecked: %s' % kwargs['dateChecked'])
-            kwargs['dateChecked'] = date_checked
+            kwargs['dateChecked'] = CoreData._parse_aware_datetime(date_checked, 'dateChecked')
 
         # "date" is expected to be a date string, no times or timezones
         if 'date' in kwargs:
@@ -376,11 +559,20 @@ class CoreData(db.Model, DataMixin):
             kwargs['date'] = date.today()
         return kwargs
 
+    @classmethod
+    def column_values(cls, kwargs):
+        """Normalize input fields exactly like the constructor does, without creating an object.
+
+        Returns a dict with a value (``None`` if missing) for every column, suitable for writing
+        many rows at once with a bulk ``INSERT``.
+        """
+        # strip any empty string fields from kwargs
+        kwargs = {k: v for k, v in kwargs.items() if v is not None and v != ""}
+        kwargs = cls._cleanup_date_kwargs(kwargs)
+        return {name: kwargs.get(name) for name in cls._column_names}
+
     def copy_with_updates(self, **kwargs):
-        kwargs = self._cleanup_date_kwargs(kwargs)
-        self_props = self.to_dict()
-        self_props.update(kwargs)
-        return CoreData(**self_props)
+        return CoreData(**self.updated_values(self.normalized_fields(kwargs)))
 
     def __init__(self, **kwargs):
         # strip any empty string fields from kwargs
@@ -390,3 +582,45 @@ class CoreData(db.Model, DataMixin):
         mapper = class_mapper(CoreData)
         relevant_kwargs = {k: v for k, v in kwargs.items() if k in mapper.attrs.keys()}
         super(CoreData, self).__init__(**relevant_kwargs)
+
+
+# indexes for the hot coreData access paths:
+# - the revisions of a (state, date), newest first: state date history, existence checks, and the
+#   GROUP BY (state, date) looking for the latest batch
+# - all the rows of a batch, which the primary key can't serve since it doesn't start with batchId
+db.Index('ix_coreData_state_date_batchId', CoreData.state, CoreData.date, CoreData.batchId.desc())
+db.Index('ix_coreData_batchId', CoreData.batchId)
+# only published daily/edit batches are public, see app.api.common._latest_batches_filters
+db.Index('ix_batches_published_daily_edit', Batch.batchId,
+         postgresql_where=and_(Batch.isPublished == True, Batch.dataEntryType.in_(['daily', 'edit'])))
+
+
+# generate the serializers once at import time
+for model in (Batch, State, CoreData):
+    model.compile_serializer()
+
+# column positions in CoreData._row_values, for diffing edits. We expect batch IDs to be
+# different, skip comparing those
+CoreData._column_index = {name: i for i, name in enumerate(CoreData._column_names)}
+CoreData._diffed_columns = tuple(
+    (name, i) for name, i in CoreData._column_index.items() if name != 'batchId')
+
+
+class LatestCoreData(db.Model):
+    """Materialized pointer to the latest published ``coreData`` revision for each (state, date).
+
+    This table is maintained incrementally (see ``app.api.common.update_latest_core_data``) every
+    time a batch is published, so that reading the current published data is a plain indexed join
+    instead of a GROUP BY over every historical revision.
+    """
+    __tablename__ = 'latestCoreData'
+
+    state = db.Column(db.String, db.ForeignKey('states.state'), nullable=False, primary_key=True)
+    date = db.Column(db.Date, nullable=False, primary_key=True)
+    batchId = db.Column(db.Integer, db.ForeignKey('batches.batchId'), nullable=False)
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ['state', 'batchId', 'date'],
+            ['coreData.state', 'coreData.batchId', 'coreData.date']),
+    )
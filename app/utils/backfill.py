@@ -6,13 +6,16 @@ import flask
 import json
 
 from app import db
-from app.models.data import Batch, CoreData, State
+from app.api.common import update_latest_core_data
+from app.models.data import Batch, CoreData, LatestCoreData, State
+from app.utils.cache import bump_data_generation
 
 
 def backfill(input_file):
     flask.current_app.logger.info('Backfilling core data from %s' % input_file)
 
     # blow away all core data, states, batches
+    LatestCoreData.query.delete()
     CoreData.query.delete()
     State.query.delete()
     Batch.query.delete()
@@ -30,6 +33,9 @@ def backfill(input_file):
         batch.isPublished = True
         batch.publishedAt = datetime.utcnow()   # set publish time to now
         db.session.add(batch)
+        db.session.flush()
+        update_latest_core_data(batch_id)
         db.session.commit()
+        bump_data_generation()
 
     flask.current_app.logger.info('Backfilling complete!')
@@ -0,0 +1,248 @@
+"""HTTP caching for the public read endpoints.
+
+Responses are keyed by endpoint, view arguments, query arguments and a global data generation
+counter. The counter is the ``dataGeneration`` Postgres sequence: every write path bumps it once
+its transaction is committed, so a write handled by any worker invalidates the cached responses
+of every worker. Stale entries are never served again and simply age out of the LRU.
+
+The counter is also the time of the latest write, in seconds since the epoch: a bump moves it to
+the current time, or by one if it's already there. So it still strictly increases, and every
+generation gets its own ``Last-Modified`` second, whether or not the write published a batch.
+"""
+import collections
+from datetime import datetime
+import functools
+import hashlib
+import threading
+
+from flask import current_app, g, request
+import pytz
+from sqlalchemy import text
+
+from app import db
+
+
+DataVersion = collections.namedtuple('DataVersion', 'generation batchId publishedAt')
+
+# last_value is already the start value before nextval is first called, so check is_called
+DATA_VERSION_SQL = (
+    'SELECT (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM "dataGeneration"), '
+    'max("batchId"), max("publishedAt") FROM batches WHERE "isPublished"')
+
+# the current time in seconds, unless the counter is already there (several writes in a second)
+BUMP_DATA_GENERATION_SQL = (
+    'SELECT setval(\'"dataGeneration"\', GREATEST(nextval(\'"dataGeneration"\'), '
+    'floor(extract(epoch FROM clock_timestamp()))::bigint))')
+
+
+def current_data_version():
+    """Return the current ``DataVersion``: the data generation counter and the ID and publish time
+    of the latest published batch.
+
+    This is a single cheap query, and the result is memoized for the rest of the request.
+    """
+    if 'data_version' not in g:
+        row = db.session.execute(text(DATA_VERSION_SQL)).first()
+        g.data_version = DataVersion(*row)
+    return g.data_version
+
+
+def current_data_generation():
+    """Return the current value of the data generation counter"""
+    return current_data_version().generation
+
+
+def bump_data_generation():
+    """Invalidate all cached responses, in every worker.
+
+    Must be called *after* the write has been committed: bumping the counter any earlier would
+    let a concurrent reader cache the pre-write data under the new generation.
+    """
+    db.session.execute(text(BUMP_DATA_GENERATION_SQL))
+    db.session.commit()
+    g.pop('data_version', None)
+
+
+class ResponseCache:
+    """A bounded LRU mapping of cache keys to (body, status, headers) tuples.
+
+    Bodies larger than ``max_entry_size`` bytes are not cached.
+    """
+
+    def __init__(self, max_size, max_entry_size=8 * 1024 * 1024):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0 or len(value[0]) > self.max_entry_size:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class BodyBuffer:
+    """Collects the chunks of a streamed response body for the cache, as long as they add up to
+    at most ``max_size`` bytes. Past that they're dropped, so a large body is never held in
+    memory in full, and ``body`` is None.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._chunks = []
+
+    def append(self, chunk):
+        if self._chunks is None:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            self._chunks = None
+        else:
+            self._chunks.append(chunk)
+
+    @property
+    def body(self):
+        return None if self._chunks is None else b''.join(self._chunks)
+
+
+def cached_response(view):
+    """Decorator caching a successful view response until the data generation changes"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions['response_cache']
+        if cache.max_size <= 0:
+            return view(*args, **kwargs)
+
+        key = (request.endpoint,
+               tuple(sorted(kwargs.items())),
+               tuple(sorted(request.args.items(multi=True))),
+               current_data_generation())
+        cached = cache.get(key)
+        if cached is not None:
+            body, status, headers = cached
+            return current_app.response_class(body, status=status, headers=headers)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            if response.is_streamed:
+                # don't buffer streamed responses up front, store them once fully sent if they
+                # aren't too large
+                response.response = _cache_when_sent(
+                    cache, key, response.response, response.status_code, list(response.headers))
+            else:
+                cache.set(key, (response.get_data(), response.status_code, list(response.headers)))
+        return response
+    return wrapper
+
+
+def _cache_when_sent(cache, key, iterable, status, headers):
+    buffer = BodyBuffer(cache.max_entry_size)
+    try:
+        for chunk in iterable:
+            buffer.append(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield chunk
+        if buffer.body is not None:
+            cache.set(key, (buffer.body, status, headers))
+    finally:
+        # a client disconnecting closes this generator, pass that on to the wrapped stream
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def _utc_naive(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(pytz.utc).replace(tzinfo=None)
+    return value.replace(microsecond=0)
+
+
+def response_etag(endpoint, view_args, args, version):
+    """Return the strong ETag of a response, derived from the request and the ``DataVersion``
+
+    Args:
+        endpoint (str): endpoint of the request
+        view_args (dict): view arguments of the request
+        args: query arguments of the request, as (name, value) pairs
+        version (DataVersion): current data version
+    """
+    # the timezone of the publish time depends on the database driver, only the instant matters
+    published_at = version.publishedAt and _utc_naive(version.publishedAt).isoformat()
+    return hashlib.sha1(repr((
+        endpoint,
+        tuple(sorted(view_args.items())),
+        tuple(sorted(args)),
+        (version.generation, version.batchId, published_at))).encode('utf-8')).hexdigest()
+
+
+def response_last_modified(version, args):
+    """Return the ``Last-Modified`` time of a response, as a naive UTC datetime: the time of the
+    latest write, from the data generation counter. None for preview requests, or if nothing was
+    ever written.
+    """
+    if not version.generation or 'preview' in args:
+        return None
+    return datetime.utcfromtimestamp(version.generation)
+
+
+def last_modified_header(last_modified):
+    """Return the value of the ``Last-Modified`` header for a ``response_last_modified`` time.
+
+    That time comes from the database clock: if it's ahead of this server's, the header is clamped
+    to the current time, as a ``Last-Modified`` in the future would keep clients from revalidating.
+    Conditional requests are still checked against the unclamped time, so they get the new data.
+    """
+    return min(last_modified, datetime.utcnow().replace(microsecond=0))
+
+
+def is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+    """Whether a conditional request can be answered with a 304, given its parsed ``If-None-Match``
+    (``ETags``) and ``If-Modified-Since`` (datetime) headers
+    """
+    if if_none_match:
+        return if_none_match.contains(etag)
+    if if_modified_since and last_modified is not None:
+        return last_modified <= _utc_naive(if_modified_since)
+    return False
+
+
+def conditional_response(view):
+    """Decorator adding ``ETag`` and ``Last-Modified`` headers to a successful view response, and
+    answering matching conditional requests with a 304 without calling the view at all.
+
+    The strong ETag is derived from the request and the current ``DataVersion``, so it changes
+    whenever data is written. ``Last-Modified`` is the time of the latest write, which changes along
+    with it; it's omitted for preview requests.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = current_data_version()
+        etag = response_etag(request.endpoint, kwargs, request.args.items(multi=True), version)
+        last_modified = response_last_modified(version, request.args)
+
+        if is_not_modified(etag, last_modified, request.if_none_match, request.if_modified_since):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified_header(last_modified)
+        return response
+    return wrapper
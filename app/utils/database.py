@@ -0,0 +1,54 @@
+"""Per-request database settings: statement timeouts and connection tagging.
+
+Every transaction started while handling a request sets, for that transaction only, a
+``statement_timeout`` and an ``application_name`` naming the endpoint, so that a runaway query is
+canceled by Postgres (and shows up in ``pg_stat_activity`` with the route that ran it) rather than
+holding its pooled connection until gunicorn kills the worker.
+
+Requests get the ``DB_STATEMENT_TIMEOUT`` by default, routes decorated with ``statement_timeout``
+the one from another config key. Queries run outside of requests (CLI commands, migrations) are
+not limited.
+"""
+import functools
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, text
+
+from app import db
+
+REQUEST_SETTINGS_SQL = text(
+    "SELECT set_config('statement_timeout', :timeout, true), "
+    "set_config('application_name', :application_name, true)")
+
+
+def statement_timeout(config_key):
+    """Run the wrapped route with the statement timeout set in the config with ``config_key``,
+    in milliseconds (0 for no timeout).
+
+    Must be applied before any query is made by the request, i.e. above ``conditional_response``.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            g.statement_timeout_key = config_key
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def request_statement_timeout():
+    """Return the statement timeout of the current request in milliseconds"""
+    key = g.get('statement_timeout_key', 'DB_STATEMENT_TIMEOUT')
+    return current_app.config.get(key, current_app.config.get('DB_STATEMENT_TIMEOUT', 30000))
+
+
+@event.listens_for(db.session, 'after_begin')
+def apply_request_settings(session, transaction, connection):
+    if not has_request_context():
+        return
+    application_name = '%s:%s' % (
+        current_app.config.get('DB_APPLICATION_NAME', 'covid-publishing-api'), request.endpoint)
+    connection.execute(REQUEST_SETTINGS_SQL, {
+        'timeout': str(request_statement_timeout()),
+        # Postgres truncates longer names
+        'application_name': application_name[:63]})
@@ -0,0 +1,151 @@
+"""Background dispatch of outbound notifications, so requests don't wait on external services.
+
+Requests only enqueue jobs into a ``BackgroundDispatcher``, which runs them on a worker thread.
+The queue is bounded: when it's full, new jobs are dropped (and logged) rather than blocking the
+request. Failing jobs are retried with exponential backoff. Jobs waiting before they run (see
+``BackgroundDispatcher.sleep``) stop waiting when the process exits, so they are run rather than
+lost.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class BackgroundDispatcher:
+    """Runs jobs on a background thread.
+
+    The thread is started on the first submitted job, and restarted in each process forked after
+    that (e.g. gunicorn workers of a preloaded app). Pending jobs are drained when the process
+    exits, without waiting for their delays or retry backoffs.
+
+    Args:
+        name (str): name of the worker thread, used in logs
+        logger: logger for dropped and failed jobs
+        max_size (int): maximum number of pending jobs, further jobs are dropped
+        retries (int): number of times a failing job is retried
+        backoff (float): delay before the first retry in seconds, doubled for each further retry
+        on_failure: optional function called with ``(job, args, kwargs, exception)`` when a job
+            failed after all its retries
+    """
+
+    def __init__(self, name, logger, max_size=100, retries=2, backoff=1.0, on_failure=None):
+        self.name = name
+        self.logger = logger
+        self.max_size = max_size
+        self.retries = retries
+        self.backoff = backoff
+        self.on_failure = on_failure
+        # number of jobs dropped because the queue was full, and of jobs failed after all retries
+        self.dropped = 0
+        self.failed = 0
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        atexit.register(self.shutdown)
+
+    def submit(self, job, *args, **kwargs):
+        """Queue ``job(*args, **kwargs)`` to be run in the background.
+
+        Returns:
+            bool: False if the job was dropped because the queue is full
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((job, args, kwargs))
+        except queue.Full:
+            self.dropped += 1
+            self.logger.error('%s queue is full, dropping %s' % (self.name, job.__name__))
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until all the queued jobs have been run, e.g. in tests.
+
+        Returns:
+            bool: False if jobs are still pending after ``timeout`` seconds
+        """
+        if self._queue is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def sleep(self, seconds):
+        """Wait for ``seconds`` in a job, unless the dispatcher is shutting down.
+
+        Returns:
+            bool: False if the wait was cut short by a shutdown
+        """
+        return not self._stopping.wait(seconds)
+
+    def shutdown(self, timeout=10):
+        """Run the pending jobs, waiting at most ``timeout`` seconds, then stop the worker thread"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                return
+            thread = self._thread
+            self._thread = None
+        # wake up the job currently waiting, if any, and don't wait for the next ones
+        self._stopping.set()
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            self.logger.error('%s could not drain its queue before shutting down' % self.name)
+            return
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # a forked process inherits the queue but not the thread: start over
+            self._queue = queue.Queue(self.max_size)
+            self._pid = os.getpid()
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._run_job(*item)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job, args, kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                job(*args, **kwargs)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    self.logger.error('%s job %s failed: %s' % (self.name, job.__name__, e))
+                    if self.on_failure is not None:
+                        try:
+                            self.on_failure(job, args, kwargs, e)
+                        except Exception as failure_error:
+                            self.logger.error('%s failure handler failed: %s' % (
+                                self.name, failure_error))
+                    return
+                delay = self.backoff * 2 ** attempt
+                self.logger.warning('%s job %s failed, retrying in %.1fs: %s' % (
+                    self.name, job.__name__, delay, e))
+                self.sleep(delay)
@@ -35,7 +35,7 @@ class EditDiff:
 
     Attributes:
         changed_rows: a list of `ChangedRow` elements containing each edited row
-        new_rows: a list of newly added rows, expressed as CoreData objects
+        new_rows: a list of newly added rows, expressed as objects with (at least) state and date attributes
     """
 
     def __init__(self, changed_rows, new_rows):
@@ -0,0 +1,110 @@
+"""Pooled HTTP sessions for outbound calls (Slack, the webhook).
+
+Outbound calls go through a ``requests`` session that keeps connections alive, so consecutive
+calls to the same host reuse a connection instead of paying for a new TCP and TLS handshake.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class OutboundHTTP:
+    """The per-process HTTP session of an app, with a bounded connection pool per host.
+
+    The session is created on first use, and created again in each process forked after that
+    (e.g. gunicorn workers of a preloaded app), as connections can't be shared across processes.
+
+    Args:
+        pool_size (int): maximum number of connections kept alive per host
+        timeout (float): default timeout of the calls in seconds, for connecting and for reading
+    """
+
+    def __init__(self, pool_size=10, timeout=10):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # number of requests sent, and of connections opened to send them
+        self.requests = 0
+        self.connections = 0
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self.requests = 0
+                    self.connections = 0
+                    self._session = PooledSession(self)
+                    self._pid = os.getpid()
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pooled session, with the default timeout unless given"""
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def count(self, requests=0, connections=0):
+        with self._lock:
+            self.requests += requests
+            self.connections += connections
+
+    def stats(self):
+        """Counters of the pool usage in this process"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': max(self.requests - self.connections, 0),
+                'poolSize': self.pool_size,
+            }
+
+
+class PooledSession(requests.Session):
+    """A ``requests`` session applying a default timeout and counting requests and connections"""
+
+    def __init__(self, http):
+        super().__init__()
+        self.http = http
+        adapter = CountingAdapter(http, pool_connections=http.pool_size,
+                                  pool_maxsize=http.pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.http.timeout
+        self.http.count(requests=1)
+        return super().request(method, url, **kwargs)
+
+
+class CountingAdapter(HTTPAdapter):
+    """Transport adapter counting the connections opened by its pools"""
+
+    def __init__(self, http, **kwargs):
+        self.http = http
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        http = self.http
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    http.count(connections=1)
+                    return super()._new_conn()
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: counting(pool_class) for scheme, pool_class in pool_classes.items()}
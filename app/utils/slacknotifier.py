@@ -2,14 +2,48 @@
 import traceback
 
 from slack import WebClient
-from slack.errors import SlackApiError
 from flask import current_app
 import functools
 
 
-def client():
-    token = current_app.config["SLACK_API_TOKEN"]
-    return WebClient(token=token)
+class PooledWebClient(WebClient):
+    """Slack client sending its requests through the app's pooled HTTP session (see
+    app/utils/outbound.py), instead of opening a new connection for each call"""
+
+    def __init__(self, http, **kwargs):
+        self.http = http
+        super().__init__(timeout=http.timeout, **kwargs)
+
+    # overrides a private method of slackclient's WebClient, whose version is pinned in
+    # requirements.txt for that reason: outbound_test checks this against the real client
+    def _perform_urllib_http_request(self, *, url, args):
+        # the content headers are set by requests, for the body built below
+        headers = {k: v for k, v in args["headers"].items()
+                   if k.lower() not in ("content-type", "content-length")}
+        if args["json"]:
+            body = {"json": args["json"]}
+        elif args["data"]:
+            data = args["data"]
+            files = {k: (data.get("filename") or getattr(v, "name", None) or "Uploaded file", v)
+                     for k, v in data.items() if getattr(v, "readable", None) and v.readable()}
+            fields = {k: str(v) for k, v in data.items() if k not in files}
+            body = {"data": fields, "files": files}
+        else:
+            body = {"data": args["params"] or None}
+
+        response = self.http.post(url, headers=headers, timeout=self.timeout, **body)
+        return {"status": response.status_code, "headers": response.headers,
+                "body": response.text}
+
+
+def outbound_http():
+    """The app's pooled HTTP session for outbound calls"""
+    return current_app.extensions['outbound_http']
+
+
+def client(token=None, http=None):
+    return PooledWebClient(http or outbound_http(),
+                           token=token or current_app.config["SLACK_API_TOKEN"])
 
 
 def channel():
@@ -20,54 +54,69 @@ def should_call_slack():
     return current_app.config["SLACK_API_TOKEN"] and current_app.config["SLACK_CHANNEL"]
 
 
+def dispatcher():
+    """The app's background dispatcher for Slack notifications (see app/utils/dispatcher.py)"""
+    return current_app.extensions['slack_dispatcher']
+
+
 def notify_slack(message, file_attachment=None):
     """Send `message` to the Slack channel configured in the environment config
 
+    The message is sent in the background: this only queues it.
+
     Args:
         message (str): message to be sent to Slack
         file_attachment (str): optional file to be attached to the message inside a thread
     """
-    try:
-        if should_call_slack():
-            response = client().chat_postMessage(
-                channel=channel(),
-                text=message
-            )
-
-            # send the attachment, if present, as a thread to the initial message
-            if file_attachment is not None and response.validate() and response.get("ts") is not None:
-                client().files_upload(
-                    channels=channel(),
-                    thread_ts=response.get("ts"),
-                    content=file_attachment,
-                    filetype='text',
-                    title='Changes',
-                    initial_comment=f":ctp-eye:"
-                )
-    except SlackApiError as e:
-        # just log Slack failures but don't break on them
-        current_app.logger.error(e.response["error"])
+    if should_call_slack():
+        slack_dispatcher = dispatcher()
+        slack_dispatcher.submit(
+            _post_message, slack_dispatcher, outbound_http(),
+            current_app.config["SLACK_API_TOKEN"], channel(), message, file_attachment)
 
 
 def notify_slack_error(message, source):
     """Send error message `message` to the Slack channel configured in the environment config.
     The error is delivered to Slack as a file for visual distinctiveness and to provide an expanding
     view for long exceptions without cluttering the channel.
+
+    The message is sent in the background: this only queues it.
+
     Args:
         message (str): Error message
         source (str): The operation or API endpoint causing the error (e.g. `post_core_data`)
     """
-    try:
-        if should_call_slack():
-            client().files_upload(
-                channels=channel(),
-                content=message,
-                filetype='text',
-                title='Error details',
-                initial_comment=f"*:rotating_light: Error in {source}*"
-            )
-    except SlackApiError as slack_error:
-        current_app.logger.error(slack_error.response["error"])
+    if should_call_slack():
+        dispatcher().submit(
+            _upload_file, outbound_http(), current_app.config["SLACK_API_TOKEN"], channel(),
+            content=message, title='Error details',
+            initial_comment=f"*:rotating_light: Error in {source}*")
+
+
+def _post_message(slack_dispatcher, http, token, channel, message, file_attachment):
+    response = client(token, http).chat_postMessage(
+        channel=channel,
+        text=message
+    )
+
+    # send the attachment, if present, as a thread to the initial message. This is a separate job,
+    # so that retrying a failed upload doesn't post the message again
+    if file_attachment is not None and response.validate() and response.get("ts") is not None:
+        slack_dispatcher.submit(
+            _upload_file, http, token, channel, content=file_attachment, title='Changes',
+            initial_comment=f":ctp-eye:", thread_ts=response.get("ts"))
+
+
+def _upload_file(http, token, channel, content, title, initial_comment, thread_ts=None):
+    kwargs = {'thread_ts': thread_ts} if thread_ts is not None else {}
+    client(token, http).files_upload(
+        channels=channel,
+        content=content,
+        filetype='text',
+        title=title,
+        initial_comment=initial_comment,
+        **kwargs
+    )
 
 
 def exceptions_to_slack(function):
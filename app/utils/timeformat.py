@@ -0,0 +1,41 @@
+"""Memoized formatting of timestamps for the API output.
+
+Rows pushed in the same batch mostly share identical lastUpdateTime/dateChecked values, so each
+distinct timestamp is converted and formatted once instead of once per serialized row. Results
+are keyed on the timestamp itself: aware datetimes for the same instant are equal and hash alike,
+and every format here only depends on the instant.
+
+The timezones are resolved once, at import time.
+"""
+
+from datetime import timedelta
+import functools
+
+from dateutil import tz
+import pytz
+
+EASTERN_TIME = pytz.timezone('US/Eastern')
+# the public sheet CSV output used a fixed EST offset, see format_csv_date_checked
+CSV_EASTERN_TIME = tz.gettz('EST')
+
+# number of distinct timestamps remembered by each formatter
+FORMAT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_utc(value):
+    """Format a timestamp as an ISO 8601 UTC string, e.g. ``2020-05-04T20:03:00Z``"""
+    return value.astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_eastern(value):
+    """Format a timestamp in Eastern Time, the way ``lastUpdateEt`` is output, e.g. ``5/4/2020 16:03``"""
+    return value.astimezone(EASTERN_TIME).strftime("%-m/%-d/%Y %H:%M")
+
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_csv_date_checked(value):
+    """Format a timestamp like the ``dateChecked`` column of the old public sheet CSV output"""
+    # due to DST issues, this time needs to be advanced forward one hour to match the old output
+    return (value.astimezone(CSV_EASTERN_TIME) + timedelta(hours=1)).strftime("%-m/%d/%Y %H:%M")
@@ -1,13 +1,103 @@
 """Used to call out to an external webhook (i.e. the public API build tool)
  when publishing new data to the database. The webhook URL is set in the
- environment with the `API_WEBHOOK_URL` variable"""
+ environment with the `API_WEBHOOK_URL` variable.
+
+ Calls are made from a background thread through the app's pooled HTTP session,
+ with a timeout and retries. Triggers arriving within `WEBHOOK_COALESCE_WINDOW`
+ seconds of each other result in a single call, so a burst of edits kicks off a
+ single build. Coalescing happens within a process: with several gunicorn workers,
+ each of them makes its own call for a burst of triggers it received.
+
+ A call still waiting for the end of its window when the process exits is made
+ right away rather than lost."""
 import functools
-import requests
+import threading
+import time
+
 from flask import current_app
 
+from app.utils.dispatcher import BackgroundDispatcher
 from app.utils.slacknotifier import notify_slack_error
 
 
+class WebhookError(Exception):
+    pass
+
+
+class WebhookNotifier:
+    """Calls webhooks in the background for an app, coalescing triggers.
+
+    The first trigger for a URL schedules a call at the end of the coalescing window. Any other
+    trigger for that URL arriving before the call is made is folded into it. Failed calls are
+    retried with exponential backoff, and reported to Slack once all retries failed.
+
+    Triggers are only coalesced within the current process (i.e. gunicorn worker).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.http = app.extensions['outbound_http']
+        self.window = app.config.get('WEBHOOK_COALESCE_WINDOW', 60)
+        self.timeout = app.config.get('WEBHOOK_TIMEOUT', self.http.timeout)
+        self.dispatcher = BackgroundDispatcher(
+            'webhook-notifier', app.logger,
+            max_size=app.config.get('WEBHOOK_QUEUE_SIZE', 10),
+            retries=app.config.get('WEBHOOK_RETRIES', 2),
+            backoff=app.config.get('WEBHOOK_RETRY_BACKOFF', 5.0),
+            on_failure=self._report_failure)
+        # number of triggers folded into an already scheduled call
+        self.coalesced = 0
+
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def trigger(self, url):
+        """Schedule a call to ``url``, unless one is already scheduled.
+
+        Returns:
+            bool: True if a new call was scheduled
+        """
+        with self._lock:
+            if url in self._pending:
+                self.coalesced += 1
+                return False
+            self._pending.add(url)
+
+        if not self.dispatcher.submit(call_webhook, self, url, time.monotonic() + self.window):
+            with self._lock:
+                self._pending.discard(url)
+            return False
+        return True
+
+    def _start_call(self, url):
+        # triggers arriving from now on need another call, this one may not see their changes
+        with self._lock:
+            self._pending.discard(url)
+
+    def _report_failure(self, job, args, kwargs, error):
+        url = args[1]
+        with self.app.app_context():
+            current_app.logger.error('Request to webhook %s failed: %s' % (url, error))
+            notify_slack_error(f"notify_webhook failed: #{str(error)}", "do_notify_webhook")
+
+
+def call_webhook(notifier, url, not_before):
+    """Call the webhook at ``url``, once the coalescing window ending at ``not_before`` is over.
+
+    Raises an exception if the call fails, for the dispatcher to retry it.
+    """
+    delay = not_before - time.monotonic()
+    if delay > 0:
+        # cut short when the process exits
+        notifier.dispatcher.sleep(delay)
+    notifier._start_call(url)
+
+    response = notifier.http.get(url, timeout=notifier.timeout)
+    if response.status_code != 200:
+        raise WebhookError('(#%s): #%s' % (response.status_code, response.text))
+    return response
+
+
 def notify_webhook(func):
     """Notifies a webhook (defined in the config with "API_WEBHOOK_URL") if the function it wraps is successful.
     Used to kick off the public API build after data changes."""
@@ -24,25 +114,16 @@ def notify_webhook(func):
 
 
 def do_notify_webhook():
+    """Schedule a call to the webhook in the background.
+
+    This is best-effort and never fails: errors are logged and reported to Slack.
+
+    Returns:
+        bool: True if a new call was scheduled, False if the trigger was folded into an already
+        scheduled call, or if there's no webhook configured
+    """
     url = current_app.config['API_WEBHOOK_URL']
     if not url:  # nothing to do for dev environments without a url set
-        return
-
-    try:
-        response = requests.get(url)
-    except Exception as e:
-        current_app.logger.warning(
-            'Request to webhook %s failed returned an error: %s' % (url, str(e)))
-        notify_slack_error(f"notify_webhook failed: #{str(e)}", "do_notify_webhook")
         return False
 
-    if response.status_code != 200:
-        # log an error but do not raise an exception
-        # This method would usually run *after a commit*, as a best-effort
-        # method, it should not fail a response to the user
-        current_app.logger.error(
-            'Request to webhook %s finished unsuccessfully: %s, the response is:\n%s'
-            % (url, response.status_code, response.text))
-        notify_slack_error(f"notify_webhook failed (#{response.status_code}): #{response.text}", "do_notify_webhook")
-
-    return response
+    return current_app.extensions['webhook_notifier'].trigger(url)
@@ -0,0 +1,9 @@
+"""ASGI entry point serving the read-only public API on asyncio (see app/asgi.py), with the same
+configuration as the Flask app in flask_server.py, e.g.:
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi_server:app
+"""
+from app.asgi import PublicAPI
+from flask_server import app as flask_app
+
+app = PublicAPI(flask_app)
@@ -0,0 +1,59 @@
+"""Microbenchmark for parsing dates and timestamps on ingest.
+
+Normalizes the core data rows of ``tests/app/data.json`` with ``CoreData.column_values``, as done
+when posting a batch, once with the regular expression fast paths of ``parse_str_to_date`` and
+``_parse_datetime_str`` and once going through ``dateutil`` for every value like before. Doesn't
+need a database. Run from the repository root with:
+
+    python -m benchmarks.date_parsing
+"""
+from contextlib import contextmanager
+import json
+import os
+import timeit
+
+from dateutil import parser
+
+from app.models.data import CoreData
+
+NUM_ROWS = 10000
+
+
+@contextmanager
+def dateutil_only():
+    """Temporarily parse every value with dateutil, like the original implementation"""
+    fast_date, fast_datetime = CoreData.__dict__['parse_str_to_date'], CoreData.__dict__['_parse_datetime_str']
+    CoreData.parse_str_to_date = staticmethod(
+        lambda date_input: parser.parse(str(date_input), ignoretz=True).date())
+    CoreData._parse_datetime_str = staticmethod(parser.parse)
+    try:
+        yield
+    finally:
+        CoreData.parse_str_to_date, CoreData._parse_datetime_str = fast_date, fast_datetime
+
+
+def make_rows():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tests', 'app', 'data.json')
+    with open(path) as f:
+        core_data = json.load(f)['coreData']
+    return [core_data[i % len(core_data)] for i in range(NUM_ROWS)]
+
+
+def main():
+    rows = make_rows()
+    ingest = lambda: [CoreData.column_values(row) for row in rows]
+
+    fast_rows = ingest()
+    with dateutil_only():
+        assert ingest() == fast_rows
+        slow = min(timeit.repeat(ingest, number=1, repeat=5))
+    fast = min(timeit.repeat(ingest, number=1, repeat=5))
+
+    print('Normalizing %d core data rows from tests/app/data.json' % NUM_ROWS)
+    print('  dateutil:  %.3fs (%.1f us/row)' % (slow, slow / NUM_ROWS * 1e6))
+    print('  fast path: %.3fs (%.1f us/row)' % (fast, fast / NUM_ROWS * 1e6))
+    print('  saving:    %.1f us/row (%.1fx)' % ((slow - fast) / NUM_ROWS * 1e6, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Microbenchmark for diffing and copying edited CoreData rows.
+
+Compares ``normalized_fields`` + ``diff_fields`` + ``updated_values``, which operate on plain
+column values, against the previous implementation, which built a throwaway ``CoreData`` object to
+diff each edit row and another one (through ``to_dict``) to copy it. Doesn't need a database. Run
+from the repository root with:
+
+    python -m benchmarks.edit_diffs
+"""
+import timeit
+
+from app.models.data import CoreData
+from app.utils.editdiff import ChangedValue, ChangedRow
+from benchmarks.serializers import make_rows
+
+NUM_ROWS = 300
+
+
+def object_field_diffs(row, dict_other):
+    """The original ``CoreData.field_diffs``"""
+    diffs = []
+    other = CoreData(**dict_other)
+    if 'lastUpdateIsoUtc' in dict_other and not 'lastUpdateTime' in dict_other:
+        dict_other['lastUpdateTime'] = dict_other['lastUpdateIsoUtc']
+    for field in CoreData.__table__.columns.keys():
+        if field == 'batchId':
+            continue
+        if field in dict_other and getattr(other, field) != getattr(row, field):
+            diffs.append(ChangedValue(field=field, old=getattr(row, field), new=getattr(other, field)))
+    if diffs:
+        return ChangedRow(date=row.date, state=row.state, changed_values=diffs)
+    return None
+
+
+def object_copy_with_updates(row, **kwargs):
+    """The original ``CoreData.copy_with_updates``"""
+    kwargs = CoreData._cleanup_date_kwargs(kwargs)
+    props = row.to_dict()
+    props.update(kwargs)
+    return CoreData(**props)
+
+
+def make_edits(rows):
+    """One edit dict per row, as sent to the edit API: every field, one of them changed"""
+    edits = []
+    for row in rows:
+        edit = row.to_dict()
+        edit['positive'] = (edit.get('positive') or 0) + 1
+        edit['lastUpdateIsoUtc'] = edit.pop('lastUpdateTime')
+        edit['batchId'] = 2
+        edits.append(edit)
+    return edits
+
+
+def edit_objects(rows, edits):
+    result = []
+    for row, edit in zip(rows, edits):
+        edit = dict(edit)
+        if object_field_diffs(row, edit):
+            copy = object_copy_with_updates(row, **edit)
+            result.append({name: getattr(copy, name) for name in CoreData._column_names})
+    return result
+
+
+def edit_values(rows, edits):
+    result = []
+    for row, edit in zip(rows, edits):
+        fields = CoreData.normalized_fields(edit)
+        if row.diff_fields(fields):
+            result.append(row.updated_values(fields))
+    return result
+
+
+def main():
+    rows = make_rows()[:NUM_ROWS]
+    edits = make_edits(rows)
+    assert edit_objects(rows, edits) == edit_values(rows, edits)
+    assert all(row.field_diffs(dict(edit)).changed_fields == ['positive']
+               for row, edit in zip(rows, edits))
+
+    objects = min(timeit.repeat(lambda: edit_objects(rows, edits), number=10, repeat=5)) / 10
+    values = min(timeit.repeat(lambda: edit_values(rows, edits), number=10, repeat=5)) / 10
+    print('Diffing and copying a %d row edit' % NUM_ROWS)
+    print('  objects: %.2fms (%.1f us/row)' % (objects * 1e3, objects / NUM_ROWS * 1e6))
+    print('  values:  %.2fms (%.1f us/row)' % (values * 1e3, values / NUM_ROWS * 1e6))
+    print('  speedup: %.1fx' % (objects / values))
+
+
+if __name__ == '__main__':
+    main()
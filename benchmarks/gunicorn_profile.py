@@ -0,0 +1,111 @@
+"""Benchmark of the gunicorn serving profile (``gunicorn.ini``) against the previous configuration.
+
+Starts gunicorn with each configuration in turn on the same app and database, then measures the
+time until the first response, the memory of the master and its workers (proportional set size,
+so the pages shared by the workers of a preloaded app are split between them) and the throughput
+and latency under load (see ``benchmarks/public_load.py``).
+
+Run from the repository root, with the environment set up for the app to reach a seeded database:
+
+    python -m benchmarks.gunicorn_profile --concurrency 32 --duration 30
+"""
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.public_load import PATHS, run, report
+
+# gunicorn.ini before the production profile: one sync worker, reloading the app on changes
+PREVIOUS_CONFIG = '''
+reload = True
+bind = ":8000"
+timeout = 60
+'''
+
+
+def wait_until_ready(port, path, timeout=120):
+    """Return the time it took for ``path`` to return a response"""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        try:
+            conn.request('GET', path)
+            conn.getresponse().read()
+            return time.monotonic() - start
+        except OSError:
+            time.sleep(0.1)
+        finally:
+            conn.close()
+    raise RuntimeError('the server did not start within %ds' % timeout)
+
+
+def pss_kb(pid):
+    """Proportional set size of a process in KB, from /proc (Linux only)"""
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def process_tree(pid):
+    children = []
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return [pid] + children
+
+
+def benchmark(name, config_path, args):
+    command = [sys.executable, '-m', 'gunicorn', '-c', config_path, '-b', ':%d' % args.port,
+               args.app]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        startup = wait_until_ready(args.port, PATHS[0])
+        base = 'http://127.0.0.1:%d' % args.port
+        # warm up every route in every worker before measuring
+        run(base, args.paths or PATHS, args.concurrency, min(args.duration, 5))
+        latencies, errors, _, elapsed = run(base, args.paths or PATHS, args.concurrency,
+                                            args.duration)
+
+        pids = process_tree(server.pid)
+        memory = [pss_kb(pid) for pid in pids]
+        print('== %s: %d workers' % (name, len(pids) - 1))
+        print('first response after %.1fs' % startup)
+        if None not in memory:
+            print('memory (PSS): %.1f MB in total, %.1f MB per worker' % (
+                sum(memory) / 1024, sum(memory[1:]) / 1024 / max(len(memory) - 1, 1)))
+        report(latencies, errors, elapsed)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--app', default='flask_server:app', help='WSGI app to serve')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=16, help='number of clients')
+    parser.add_argument('--duration', type=float, default=30, help='duration in seconds')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='path to fetch, can be repeated (default: a mix of public routes)')
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.py') as previous:
+        previous.write(PREVIOUS_CONFIG)
+        previous.flush()
+        benchmark('previous config', previous.name, args)
+    benchmark('gunicorn.ini', os.path.join(os.path.dirname(__file__), '..', 'gunicorn.ini'), args)
+
+
+if __name__ == '__main__':
+    main()
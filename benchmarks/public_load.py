@@ -0,0 +1,142 @@
+"""Load test for the public read API, to compare serving modes.
+
+Runs a closed loop of concurrent clients against a running server, each fetching the given paths
+in turn over a keep-alive connection, and reports throughput and latency percentiles. Slow clients
+can be added: they fetch the largest path while reading the response a few KB at a time, which is
+what pins a sync worker for the whole transfer. Only needs the standard library.
+
+Start a server on the same seeded database, e.g. the Flask app on sync workers:
+
+    gunicorn -w 4 -b :8000 flask_server:app
+
+or the ASGI serving mode (see app/asgi.py):
+
+    gunicorn -w 4 -b :8000 -k uvicorn.workers.UvicornWorker asgi_server:app
+
+then run from the repository root:
+
+    python -m benchmarks.public_load http://localhost:8000 --concurrency 32 --slow-clients 8
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+PATHS = [
+    '/api/v1/public/states/info',
+    '/api/v1/public/states/current.csv',
+    '/api/v1/public/us/daily',
+    '/api/v1/public/states/NY/daily',
+    '/api/v1/public/states/daily',
+    '/api/v1/public/states/daily.csv',
+]
+
+
+def connect(base):
+    url = urlsplit(base)
+    conn_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    return conn_class(url.hostname, url.port, timeout=60)
+
+
+def client(base, paths, deadline, latencies, errors):
+    conn = connect(base)
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.monotonic()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            latencies.append(time.monotonic() - start)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = connect(base)
+    conn.close()
+
+
+def slow_client(base, path, deadline, read_size, read_interval, completed):
+    conn = connect(base)
+    while time.monotonic() < deadline:
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            while response.read(read_size) and time.monotonic() < deadline:
+                time.sleep(read_interval)
+            if response.isclosed():
+                completed.append(1)
+            else:
+                break
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = connect(base)
+    conn.close()
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(base, paths, concurrency, duration, slow_clients=0, slow_read_size=4096,
+        slow_read_interval=0.1):
+    """Run the load test, returning the sorted latencies, the errors, the number of responses
+    completed by slow clients and the elapsed time"""
+    deadline = time.monotonic() + duration
+    latencies, errors, slow_completed = [], [], []
+    threads = [threading.Thread(target=slow_client, args=(
+        base, paths[-1], deadline, slow_read_size, slow_read_interval, slow_completed))
+        for _ in range(slow_clients)]
+    threads += [threading.Thread(target=client, args=(base, paths, deadline, latencies, errors))
+                for _ in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return latencies, errors, len(slow_completed), time.monotonic() - start
+
+
+def report(latencies, errors, elapsed):
+    print('requests: %d, errors: %d, throughput: %.1f req/s' % (
+        len(latencies), len(errors), len(latencies) / elapsed))
+    if latencies:
+        print('latency ms: mean %.1f, p50 %.1f, p95 %.1f, p99 %.1f, max %.1f' % tuple(
+            1000 * value for value in (
+                statistics.mean(latencies), percentile(latencies, 0.5),
+                percentile(latencies, 0.95), percentile(latencies, 0.99), latencies[-1])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('base', help='base URL of the server, e.g. http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of regular clients')
+    parser.add_argument('--duration', type=float, default=30, help='duration in seconds')
+    parser.add_argument('--slow-clients', type=int, default=0,
+                        help='number of clients reading slowly')
+    parser.add_argument('--slow-read-size', type=int, default=4096,
+                        help='bytes read at a time by slow clients')
+    parser.add_argument('--slow-read-interval', type=float, default=0.1,
+                        help='seconds between the reads of slow clients')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='path to fetch, can be repeated (default: a mix of public routes)')
+    args = parser.parse_args()
+
+    latencies, errors, slow_completed, elapsed = run(
+        args.base, args.paths or PATHS, args.concurrency, args.duration, args.slow_clients,
+        args.slow_read_size, args.slow_read_interval)
+    print('%d clients (+%d slow) for %.0fs against %s' % (
+        args.concurrency, args.slow_clients, elapsed, args.base))
+    report(latencies, errors, elapsed)
+    if args.slow_clients:
+        print('slow client responses completed: %d' % slow_completed)
+
+
+if __name__ == '__main__':
+    main()
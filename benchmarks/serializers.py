@@ -0,0 +1,73 @@
+"""Microbenchmark for model serialization (``DataMixin.to_dict``).
+
+Compares the compiled per-model serializers against the previous implementation, which
+introspected the table columns and ORM descriptors for every serialized row. Doesn't need a
+database. Run from the repository root with:
+
+    python -m benchmarks.serializers
+"""
+from datetime import timedelta
+import json
+import os
+import timeit
+
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.inspection import inspect
+
+from app.models.data import CoreData, State
+
+NUM_ROWS = 10000
+
+
+def reflective_to_dict(obj):
+    """The original, introspecting ``DataMixin.to_dict``"""
+    d = {}
+    for column in obj.__table__.columns:
+        repr_fn = column.info.get("repr")
+        attr = getattr(obj, column.name)
+        if attr is not None:
+            if repr_fn is not None:
+                attr = repr_fn(attr)
+            d[column.name] = attr
+    for key, prop in inspect(obj.__class__).all_orm_descriptors.items():
+        if isinstance(prop, hybrid_property):
+            d[key] = getattr(obj, key)
+    return d
+
+
+def make_rows():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tests', 'app', 'data.json')
+    with open(path) as f:
+        payload = json.load(f)
+
+    states = {s['state']: State(**s) for s in payload['states']}
+    rows = []
+    core_data = payload['coreData']
+    for i in range(NUM_ROWS):
+        row_dict = dict(core_data[i % len(core_data)])
+        row_dict['batchId'] = 1
+        row = CoreData(**row_dict)
+        row.date = row.date - timedelta(days=i // len(core_data))
+        row.state_obj = states[row.state]
+        # rows loaded from the DB have every column populated, including nulls
+        for column in CoreData.__table__.columns:
+            if column.name not in row.__dict__:
+                setattr(row, column.name, None)
+        rows.append(row)
+    return rows
+
+
+def main():
+    rows = make_rows()
+    assert all(row.to_dict() == reflective_to_dict(row) for row in rows)
+
+    reflective = min(timeit.repeat(lambda: [reflective_to_dict(row) for row in rows], number=1, repeat=5))
+    compiled = min(timeit.repeat(lambda: [row.to_dict() for row in rows], number=1, repeat=5))
+    print('Serializing %d CoreData rows' % NUM_ROWS)
+    print('  reflective: %.3fs (%.1f us/row)' % (reflective, reflective / NUM_ROWS * 1e6))
+    print('  compiled:   %.3fs (%.1f us/row)' % (compiled, compiled / NUM_ROWS * 1e6))
+    print('  speedup:    %.1fx' % (reflective / compiled))
+
+
+if __name__ == '__main__':
+    main()
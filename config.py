@@ -22,6 +22,34 @@ class LocalPSQLConfig:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+    # database connection pool of each worker: connections kept open, extra connections opened
+    # under load, seconds to wait for a free connection before failing the request, seconds after
+    # which a connection is replaced, and whether connections are checked before being used
+    DB_POOL_SIZE = env_conf('DB_POOL_SIZE', cast=int, default=5)
+    DB_MAX_OVERFLOW = env_conf('DB_MAX_OVERFLOW', cast=int, default=10)
+    DB_POOL_TIMEOUT = env_conf('DB_POOL_TIMEOUT', cast=float, default=10)
+    DB_POOL_RECYCLE = env_conf('DB_POOL_RECYCLE', cast=int, default=1800)
+    DB_POOL_PRE_PING = env_conf('DB_POOL_PRE_PING', cast=bool, default=True)
+    # connections show up under this name in pg_stat_activity, followed by the endpoint during
+    # requests
+    DB_APPLICATION_NAME = env_conf('DB_APPLICATION_NAME', cast=str, default='covid-publishing-api')
+    # statement timeouts of requests in milliseconds (0 disables them): public reads, bulk ingest
+    # and edits, and all other requests. Keep them below the gunicorn timeout, so a runaway query
+    # is canceled before its worker gets killed
+    DB_PUBLIC_STATEMENT_TIMEOUT = env_conf('DB_PUBLIC_STATEMENT_TIMEOUT', cast=int, default=10000)
+    DB_INGEST_STATEMENT_TIMEOUT = env_conf('DB_INGEST_STATEMENT_TIMEOUT', cast=int, default=50000)
+    DB_STATEMENT_TIMEOUT = env_conf('DB_STATEMENT_TIMEOUT', cast=int, default=30000)
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        # send bulk INSERTs (e.g. of a whole batch of core data) as multi-row statements
+        'executemany_mode': 'values_plus_batch',
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'application_name': DB_APPLICATION_NAME},
+    }
 
     SECRET_KEY = env_conf("SECRET_KEY", cast=str, default="12345")
     # by default, access tokens do not expire
@@ -30,6 +58,35 @@ class LocalPSQLConfig:
     API_WEBHOOK_URL = env_conf('API_WEBHOOK_URL', cast=str, default='')
     SLACK_API_TOKEN = env_conf('SLACK_API_TOKEN', cast=str, default='')
     SLACK_CHANNEL = env_conf('SLACK_CHANNEL', cast=str, default='')
+    # outbound calls (Slack, the webhook) share a keep-alive connection pool: maximum number of
+    # connections kept per host, and default timeout of the calls in seconds
+    OUTBOUND_POOL_SIZE = env_conf('OUTBOUND_POOL_SIZE', cast=int, default=10)
+    OUTBOUND_TIMEOUT = env_conf('OUTBOUND_TIMEOUT', cast=float, default=10)
+    # Slack notifications are queued and sent in the background: maximum number of pending
+    # notifications (more are dropped), and retries of failed ones with exponential backoff
+    SLACK_QUEUE_SIZE = env_conf('SLACK_QUEUE_SIZE', cast=int, default=100)
+    SLACK_RETRIES = env_conf('SLACK_RETRIES', cast=int, default=2)
+    SLACK_RETRY_BACKOFF = env_conf('SLACK_RETRY_BACKOFF', cast=float, default=1.0)
+    # the webhook is called in the background: triggers within the coalescing window (seconds)
+    # result in a single call, made at the end of the window
+    WEBHOOK_COALESCE_WINDOW = env_conf('WEBHOOK_COALESCE_WINDOW', cast=float, default=60)
+    WEBHOOK_TIMEOUT = env_conf('WEBHOOK_TIMEOUT', cast=float, default=10)
+    WEBHOOK_QUEUE_SIZE = env_conf('WEBHOOK_QUEUE_SIZE', cast=int, default=10)
+    WEBHOOK_RETRIES = env_conf('WEBHOOK_RETRIES', cast=int, default=2)
+    WEBHOOK_RETRY_BACKOFF = env_conf('WEBHOOK_RETRY_BACKOFF', cast=float, default=5.0)
+
+    # number of batches listed by /batches per page when paging without a limit, and at most
+    BATCHES_PAGE_SIZE = env_conf('BATCHES_PAGE_SIZE', cast=int, default=100)
+    BATCHES_MAX_PAGE_SIZE = env_conf('BATCHES_MAX_PAGE_SIZE', cast=int, default=1000)
+
+    # number of public API responses kept in each worker's cache, 0 disables caching
+    RESPONSE_CACHE_SIZE = env_conf('RESPONSE_CACHE_SIZE', cast=int, default=32)
+    # larger responses (in bytes) aren't cached, so they're never held in memory in full
+    RESPONSE_CACHE_MAX_ENTRY_SIZE = env_conf('RESPONSE_CACHE_MAX_ENTRY_SIZE', cast=int,
+                                             default=8 * 1024 * 1024)
+    # asyncpg connection pool of each worker of the ASGI serving mode (see app/asgi.py)
+    ASYNC_DB_POOL_MIN_SIZE = env_conf('ASYNC_DB_POOL_MIN_SIZE', cast=int, default=1)
+    ASYNC_DB_POOL_MAX_SIZE = env_conf('ASYNC_DB_POOL_MAX_SIZE', cast=int, default=10)
 
     @staticmethod
     def init_app(app):
@@ -54,6 +111,34 @@ class Production:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+    # database connection pool of each worker: connections kept open, extra connections opened
+    # under load, seconds to wait for a free connection before failing the request, seconds after
+    # which a connection is replaced, and whether connections are checked before being used
+    DB_POOL_SIZE = env_conf('DB_POOL_SIZE', cast=int, default=5)
+    DB_MAX_OVERFLOW = env_conf('DB_MAX_OVERFLOW', cast=int, default=10)
+    DB_POOL_TIMEOUT = env_conf('DB_POOL_TIMEOUT', cast=float, default=10)
+    DB_POOL_RECYCLE = env_conf('DB_POOL_RECYCLE', cast=int, default=1800)
+    DB_POOL_PRE_PING = env_conf('DB_POOL_PRE_PING', cast=bool, default=True)
+    # connections show up under this name in pg_stat_activity, followed by the endpoint during
+    # requests
+    DB_APPLICATION_NAME = env_conf('DB_APPLICATION_NAME', cast=str, default='covid-publishing-api')
+    # statement timeouts of requests in milliseconds (0 disables them): public reads, bulk ingest
+    # and edits, and all other requests. Keep them below the gunicorn timeout, so a runaway query
+    # is canceled before its worker gets killed
+    DB_PUBLIC_STATEMENT_TIMEOUT = env_conf('DB_PUBLIC_STATEMENT_TIMEOUT', cast=int, default=10000)
+    DB_INGEST_STATEMENT_TIMEOUT = env_conf('DB_INGEST_STATEMENT_TIMEOUT', cast=int, default=50000)
+    DB_STATEMENT_TIMEOUT = env_conf('DB_STATEMENT_TIMEOUT', cast=int, default=30000)
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        # send bulk INSERTs (e.g. of a whole batch of core data) as multi-row statements
+        'executemany_mode': 'values_plus_batch',
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'application_name': DB_APPLICATION_NAME},
+    }
 
     SECRET_KEY = env_conf("SECRET_KEY", cast=str, default="12345")
     # by default, access tokens do not expire
@@ -62,6 +147,35 @@ class Production:
     API_WEBHOOK_URL = env_conf('API_WEBHOOK_URL', cast=str, default='')
     SLACK_API_TOKEN = env_conf('SLACK_API_TOKEN', cast=str, default='')
     SLACK_CHANNEL = env_conf('SLACK_CHANNEL', cast=str, default='')
+    # outbound calls (Slack, the webhook) share a keep-alive connection pool: maximum number of
+    # connections kept per host, and default timeout of the calls in seconds
+    OUTBOUND_POOL_SIZE = env_conf('OUTBOUND_POOL_SIZE', cast=int, default=10)
+    OUTBOUND_TIMEOUT = env_conf('OUTBOUND_TIMEOUT', cast=float, default=10)
+    # Slack notifications are queued and sent in the background: maximum number of pending
+    # notifications (more are dropped), and retries of failed ones with exponential backoff
+    SLACK_QUEUE_SIZE = env_conf('SLACK_QUEUE_SIZE', cast=int, default=100)
+    SLACK_RETRIES = env_conf('SLACK_RETRIES', cast=int, default=2)
+    SLACK_RETRY_BACKOFF = env_conf('SLACK_RETRY_BACKOFF', cast=float, default=1.0)
+    # the webhook is called in the background: triggers within the coalescing window (seconds)
+    # result in a single call, made at the end of the window
+    WEBHOOK_COALESCE_WINDOW = env_conf('WEBHOOK_COALESCE_WINDOW', cast=float, default=60)
+    WEBHOOK_TIMEOUT = env_conf('WEBHOOK_TIMEOUT', cast=float, default=10)
+    WEBHOOK_QUEUE_SIZE = env_conf('WEBHOOK_QUEUE_SIZE', cast=int, default=10)
+    WEBHOOK_RETRIES = env_conf('WEBHOOK_RETRIES', cast=int, default=2)
+    WEBHOOK_RETRY_BACKOFF = env_conf('WEBHOOK_RETRY_BACKOFF', cast=float, default=5.0)
+
+    # number of batches listed by /batches per page when paging without a limit, and at most
+    BATCHES_PAGE_SIZE = env_conf('BATCHES_PAGE_SIZE', cast=int, default=100)
+    BATCHES_MAX_PAGE_SIZE = env_conf('BATCHES_MAX_PAGE_SIZE', cast=int, default=1000)
+
+    # number of public API responses kept in each worker's cache, 0 disables caching
+    RESPONSE_CACHE_SIZE = env_conf('RESPONSE_CACHE_SIZE', cast=int, default=32)
+    # larger responses (in bytes) aren't cached, so they're never held in memory in full
+    RESPONSE_CACHE_MAX_ENTRY_SIZE = env_conf('RESPONSE_CACHE_MAX_ENTRY_SIZE', cast=int,
+                                             default=8 * 1024 * 1024)
+    # asyncpg connection pool of each worker of the ASGI serving mode (see app/asgi.py)
+    ASYNC_DB_POOL_MIN_SIZE = env_conf('ASYNC_DB_POOL_MIN_SIZE', cast=int, default=1)
+    ASYNC_DB_POOL_MAX_SIZE = env_conf('ASYNC_DB_POOL_MAX_SIZE', cast=int, default=10)
 
     @staticmethod
     def init_app(app):
@@ -91,6 +205,34 @@ class Testing:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+    # database connection pool of each worker: connections kept open, extra connections opened
+    # under load, seconds to wait for a free connection before failing the request, seconds after
+    # which a connection is replaced, and whether connections are checked before being used
+    DB_POOL_SIZE = env_conf('DB_POOL_SIZE', cast=int, default=5)
+    DB_MAX_OVERFLOW = env_conf('DB_MAX_OVERFLOW', cast=int, default=10)
+    DB_POOL_TIMEOUT = env_conf('DB_POOL_TIMEOUT', cast=float, default=10)
+    DB_POOL_RECYCLE = env_conf('DB_POOL_RECYCLE', cast=int, default=1800)
+    DB_POOL_PRE_PING = env_conf('DB_POOL_PRE_PING', cast=bool, default=True)
+    # connections show up under this name in pg_stat_activity, followed by the endpoint during
+    # requests
+    DB_APPLICATION_NAME = env_conf('DB_APPLICATION_NAME', cast=str, default='covid-publishing-api')
+    # statement timeouts of requests in milliseconds (0 disables them): public reads, bulk ingest
+    # and edits, and all other requests. Keep them below the gunicorn timeout, so a runaway query
+    # is canceled before its worker gets killed
+    DB_PUBLIC_STATEMENT_TIMEOUT = env_conf('DB_PUBLIC_STATEMENT_TIMEOUT', cast=int, default=10000)
+    DB_INGEST_STATEMENT_TIMEOUT = env_conf('DB_INGEST_STATEMENT_TIMEOUT', cast=int, default=50000)
+    DB_STATEMENT_TIMEOUT = env_conf('DB_STATEMENT_TIMEOUT', cast=int, default=30000)
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        # send bulk INSERTs (e.g. of a whole batch of core data) as multi-row statements
+        'executemany_mode': 'values_plus_batch',
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'application_name': DB_APPLICATION_NAME},
+    }
 
     SECRET_KEY = env_conf("SECRET_KEY", cast=str, default="12345")
     # by default, access tokens do not expire
@@ -99,6 +241,35 @@ class Testing:
     API_WEBHOOK_URL = env_conf('API_WEBHOOK_URL', cast=str, default='')
     SLACK_API_TOKEN = env_conf('SLACK_API_TOKEN', cast=str, default='')
     SLACK_CHANNEL = env_conf('SLACK_CHANNEL', cast=str, default='')
+    # outbound calls (Slack, the webhook) share a keep-alive connection pool: maximum number of
+    # connections kept per host, and default timeout of the calls in seconds
+    OUTBOUND_POOL_SIZE = env_conf('OUTBOUND_POOL_SIZE', cast=int, default=10)
+    OUTBOUND_TIMEOUT = env_conf('OUTBOUND_TIMEOUT', cast=float, default=10)
+    # Slack notifications are queued and sent in the background: maximum number of pending
+    # notifications (more are dropped), and retries of failed ones with exponential backoff
+    SLACK_QUEUE_SIZE = env_conf('SLACK_QUEUE_SIZE', cast=int, default=100)
+    SLACK_RETRIES = env_conf('SLACK_RETRIES', cast=int, default=2)
+    SLACK_RETRY_BACKOFF = env_conf('SLACK_RETRY_BACKOFF', cast=float, default=1.0)
+    # the webhook is called in the background: triggers within the coalescing window (seconds)
+    # result in a single call, made at the end of the window
+    WEBHOOK_COALESCE_WINDOW = env_conf('WEBHOOK_COALESCE_WINDOW', cast=float, default=60)
+    WEBHOOK_TIMEOUT = env_conf('WEBHOOK_TIMEOUT', cast=float, default=10)
+    WEBHOOK_QUEUE_SIZE = env_conf('WEBHOOK_QUEUE_SIZE', cast=int, default=10)
+    WEBHOOK_RETRIES = env_conf('WEBHOOK_RETRIES', cast=int, default=2)
+    WEBHOOK_RETRY_BACKOFF = env_conf('WEBHOOK_RETRY_BACKOFF', cast=float, default=5.0)
+
+    # number of batches listed by /batches per page when paging without a limit, and at most
+    BATCHES_PAGE_SIZE = env_conf('BATCHES_PAGE_SIZE', cast=int, default=100)
+    BATCHES_MAX_PAGE_SIZE = env_conf('BATCHES_MAX_PAGE_SIZE', cast=int, default=1000)
+
+    # number of public API responses kept in each worker's cache, 0 disables caching
+    RESPONSE_CACHE_SIZE = env_conf('RESPONSE_CACHE_SIZE', cast=int, default=32)
+    # larger responses (in bytes) aren't cached, so they're never held in memory in full
+    RESPONSE_CACHE_MAX_ENTRY_SIZE = env_conf('RESPONSE_CACHE_MAX_ENTRY_SIZE', cast=int,
+                                             default=8 * 1024 * 1024)
+    # asyncpg connection pool of each worker of the ASGI serving mode (see app/asgi.py)
+    ASYNC_DB_POOL_MIN_SIZE = env_conf('ASYNC_DB_POOL_MIN_SIZE', cast=int, default=1)
+    ASYNC_DB_POOL_MAX_SIZE = env_conf('ASYNC_DB_POOL_MAX_SIZE', cast=int, default=10)
 
     @staticmethod
     def init_app(app):
@@ -125,10 +296,67 @@ class Develop:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+    # database connection pool of each worker: connections kept open, extra connections opened
+    # under load, seconds to wait for a free connection before failing the request, seconds after
+    # which a connection is replaced, and whether connections are checked before being used
+    DB_POOL_SIZE = env_conf('DB_POOL_SIZE', cast=int, default=5)
+    DB_MAX_OVERFLOW = env_conf('DB_MAX_OVERFLOW', cast=int, default=10)
+    DB_POOL_TIMEOUT = env_conf('DB_POOL_TIMEOUT', cast=float, default=10)
+    DB_POOL_RECYCLE = env_conf('DB_POOL_RECYCLE', cast=int, default=1800)
+    DB_POOL_PRE_PING = env_conf('DB_POOL_PRE_PING', cast=bool, default=True)
+    # connections show up under this name in pg_stat_activity, followed by the endpoint during
+    # requests
+    DB_APPLICATION_NAME = env_conf('DB_APPLICATION_NAME', cast=str, default='covid-publishing-api')
+    # statement timeouts of requests in milliseconds (0 disables them): public reads, bulk ingest
+    # and edits, and all other requests. Keep them below the gunicorn timeout, so a runaway query
+    # is canceled before its worker gets killed
+    DB_PUBLIC_STATEMENT_TIMEOUT = env_conf('DB_PUBLIC_STATEMENT_TIMEOUT', cast=int, default=10000)
+    DB_INGEST_STATEMENT_TIMEOUT = env_conf('DB_INGEST_STATEMENT_TIMEOUT', cast=int, default=50000)
+    DB_STATEMENT_TIMEOUT = env_conf('DB_STATEMENT_TIMEOUT', cast=int, default=30000)
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        # send bulk INSERTs (e.g. of a whole batch of core data) as multi-row statements
+        'executemany_mode': 'values_plus_batch',
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'application_name': DB_APPLICATION_NAME},
+    }
 
     API_WEBHOOK_URL = env_conf('API_WEBHOOK_URL', cast=str, default='')
     SLACK_API_TOKEN = env_conf('SLACK_API_TOKEN', cast=str, default='')
     SLACK_CHANNEL = env_conf('SLACK_CHANNEL', cast=str, default='')
+    # outbound calls (Slack, the webhook) share a keep-alive connection pool: maximum number of
+    # connections kept per host, and default timeout of the calls in seconds
+    OUTBOUND_POOL_SIZE = env_conf('OUTBOUND_POOL_SIZE', cast=int, default=10)
+    OUTBOUND_TIMEOUT = env_conf('OUTBOUND_TIMEOUT', cast=float, default=10)
+    # Slack notifications are queued and sent in the background: maximum number of pending
+    # notifications (more are dropped), and retries of failed ones with exponential backoff
+    SLACK_QUEUE_SIZE = env_conf('SLACK_QUEUE_SIZE', cast=int, default=100)
+    SLACK_RETRIES = env_conf('SLACK_RETRIES', cast=int, default=2)
+    SLACK_RETRY_BACKOFF = env_conf('SLACK_RETRY_BACKOFF', cast=float, default=1.0)
+    # the webhook is called in the background: triggers within the coalescing window (seconds)
+    # result in a single call, made at the end of the window
+    WEBHOOK_COALESCE_WINDOW = env_conf('WEBHOOK_COALESCE_WINDOW', cast=float, default=60)
+    WEBHOOK_TIMEOUT = env_conf('WEBHOOK_TIMEOUT', cast=float, default=10)
+    WEBHOOK_QUEUE_SIZE = env_conf('WEBHOOK_QUEUE_SIZE', cast=int, default=10)
+    WEBHOOK_RETRIES = env_conf('WEBHOOK_RETRIES', cast=int, default=2)
+    WEBHOOK_RETRY_BACKOFF = env_conf('WEBHOOK_RETRY_BACKOFF', cast=float, default=5.0)
+
+    # number of batches listed by /batches per page when paging without a limit, and at most
+    BATCHES_PAGE_SIZE = env_conf('BATCHES_PAGE_SIZE', cast=int, default=100)
+    BATCHES_MAX_PAGE_SIZE = env_conf('BATCHES_MAX_PAGE_SIZE', cast=int, default=1000)
+
+    # number of public API responses kept in each worker's cache, 0 disables caching
+    RESPONSE_CACHE_SIZE = env_conf('RESPONSE_CACHE_SIZE', cast=int, default=32)
+    # larger responses (in bytes) aren't cached, so they're never held in memory in full
+    RESPONSE_CACHE_MAX_ENTRY_SIZE = env_conf('RESPONSE_CACHE_MAX_ENTRY_SIZE', cast=int,
+                                             default=8 * 1024 * 1024)
+    # asyncpg connection pool of each worker of the ASGI serving mode (see app/asgi.py)
+    ASYNC_DB_POOL_MIN_SIZE = env_conf('ASYNC_DB_POOL_MIN_SIZE', cast=int, default=1)
+    ASYNC_DB_POOL_MAX_SIZE = env_conf('ASYNC_DB_POOL_MAX_SIZE', cast=int, default=10)
 
     # DEBUG = True
     # API configurations
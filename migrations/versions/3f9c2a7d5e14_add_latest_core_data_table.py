@@ -0,0 +1,41 @@
+"""Add latestCoreData table materializing the latest published revision per state/date
+
+Revision ID: 3f9c2a7d5e14
+Revises: bc309f70af25
+Create Date: 2020-10-12 18:22:41.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d5e14'
+down_revision = 'bc309f70af25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('latestCoreData',
+    sa.Column('state', sa.String(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('batchId', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['batchId'], ['batches.batchId'], ),
+    sa.ForeignKeyConstraint(['state'], ['states.state'], ),
+    sa.ForeignKeyConstraint(['state', 'batchId', 'date'], ['coreData.state', 'coreData.batchId', 'coreData.date'], ),
+    sa.PrimaryKeyConstraint('state', 'date')
+    )
+
+    # populate the table from the existing published data
+    op.execute('''
+        INSERT INTO "latestCoreData" (state, date, "batchId")
+        SELECT "coreData".state, "coreData".date, max("coreData"."batchId")
+        FROM "coreData" JOIN batches ON batches."batchId" = "coreData"."batchId"
+        WHERE batches."dataEntryType" IN ('daily', 'edit') AND batches."isPublished"
+        GROUP BY "coreData".state, "coreData".date
+    ''')
+
+
+def downgrade():
+    op.drop_table('latestCoreData')
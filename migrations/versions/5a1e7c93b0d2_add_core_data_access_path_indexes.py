@@ -0,0 +1,31 @@
+"""Add indexes for the coreData access paths and published daily/edit batches
+
+Revision ID: 5a1e7c93b0d2
+Revises: 8e4b1d6c2f37
+Create Date: 2020-10-14 15:41:09.318276
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1e7c93b0d2'
+down_revision = '8e4b1d6c2f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_coreData_state_date_batchId', 'coreData',
+                    ['state', 'date', sa.text('"batchId" DESC')], unique=False)
+    op.create_index('ix_coreData_batchId', 'coreData', ['batchId'], unique=False)
+    op.create_index('ix_batches_published_daily_edit', 'batches', ['batchId'], unique=False,
+                    postgresql_where=sa.text(
+                        '"isPublished" = true AND "dataEntryType" IN (\'daily\', \'edit\')'))
+
+
+def downgrade():
+    op.drop_index('ix_batches_published_daily_edit', table_name='batches')
+    op.drop_index('ix_coreData_batchId', table_name='coreData')
+    op.drop_index('ix_coreData_state_date_batchId', table_name='coreData')
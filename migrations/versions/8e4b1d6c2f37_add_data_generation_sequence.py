@@ -0,0 +1,25 @@
+"""Add dataGeneration sequence used to version cached public responses
+
+Revision ID: 8e4b1d6c2f37
+Revises: 3f9c2a7d5e14
+Create Date: 2020-10-13 11:05:12.774902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateSequence, DropSequence
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4b1d6c2f37'
+down_revision = '3f9c2a7d5e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(CreateSequence(sa.Sequence('dataGeneration')))
+
+
+def downgrade():
+    op.execute(DropSequence(sa.Sequence('dataGeneration')))
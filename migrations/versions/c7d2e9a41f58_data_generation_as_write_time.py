@@ -0,0 +1,28 @@
+"""Move the dataGeneration counter to the current time, which it now tracks
+
+Revision ID: c7d2e9a41f58
+Revises: 5a1e7c93b0d2
+Create Date: 2020-10-19 10:12:44.105377
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e9a41f58'
+down_revision = '5a1e7c93b0d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # bumps move the counter to the time of the write (see app/utils/cache.py): start from now
+    # rather than from a small count, which would read as a Last-Modified time in 1970
+    op.execute('SELECT setval(\'"dataGeneration"\', GREATEST('
+               '(SELECT last_value FROM "dataGeneration"), '
+               'floor(extract(epoch FROM clock_timestamp()))::bigint))')
+
+
+def downgrade():
+    # the counter keeps increasing either way
+    pass
@@ -0,0 +1,164 @@
+"""
+Tests for the ASGI serving mode of the public API
+"""
+import asyncio
+
+import pytest
+from flask import json
+
+from app import db
+from app.asgi import PublicAPI
+from app.models.data import State
+
+from common import daily_push_ny_wa_two_days, daily_push_ny_ca_total_test_results_different_source, \
+    edit_push_ny_yesterday_unchanged_today, wait_for_latest_write_time
+
+
+PUBLIC_PATHS = [
+    '/api/v1/public/states/info',
+    '/api/v1/public/states/info.csv',
+    '/api/v1/public/states/daily',
+    '/api/v1/public/states/daily.csv',
+    '/api/v1/public/states/current.csv',
+    '/api/v1/public/states/NY/daily',
+    '/api/v1/public/states/ca/daily',
+    '/api/v1/public/states/ZZ/daily',
+    '/api/v1/public/us/daily',
+    '/api/v1/public/us/daily.csv',
+    '/api/v1/public/us/current.csv',
+]
+
+
+@pytest.fixture
+def asgi_get(app):
+    """Return a function calling the ASGI app with a GET (or other method) request, returning its
+    status, headers and body"""
+    public_api = PublicAPI(app)
+    loop = asyncio.new_event_loop()
+
+    def get(path, headers=None, method='GET'):
+        path, _, query_string = path.partition('?')
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'root_path': '',
+            'query_string': query_string.encode('latin-1'),
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                        for k, v in (headers or {}).items()]}
+        loop.run_until_complete(public_api(scope, receive, send))
+        response_headers = {k.decode('latin-1'): v.decode('latin-1')
+                            for k, v in messages[0]['headers']}
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return messages[0]['status'], response_headers, body
+
+    yield get
+    loop.run_until_complete(public_api.close())
+    loop.close()
+
+
+def post_test_data(client, headers):
+    # published data, with states using different total test results sources
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_ca_total_test_results_different_source()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    batch_id = resp.json['batch']['batchId']
+    resp = client.post("/api/v1/batches/{}/publish".format(batch_id), headers=headers)
+    assert resp.status_code == 201
+
+    # preview data
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+
+
+def test_asgi_output_matches_flask(app, headers, asgi_get):
+    client = app.test_client()
+    post_test_data(client, headers)
+    wait_for_latest_write_time(app)
+
+    for path in PUBLIC_PATHS + ['/api/v1/public/nothing', '/api/v1/batches']:
+        for query in ('', '?preview=true', '?preview=nope'):
+            # twice: the second response comes from the cache
+            for _ in range(2):
+                resp = client.get(path + query)
+                status, response_headers, body = asgi_get(path + query)
+                if path == '/api/v1/batches':
+                    # only the public read API is served
+                    assert status == 404
+                    continue
+                assert status == resp.status_code, path + query
+                assert body == resp.data, path + query
+                assert response_headers['content-type'] == resp.headers['Content-Type']
+                assert response_headers.get('etag') == resp.headers.get('ETag')
+                assert response_headers.get('last-modified') == resp.headers.get('Last-Modified')
+
+    # the responses still match after an edit
+    resp = client.post(
+        "/api/v1/batches/edit_states_daily",
+        data=json.dumps(edit_push_ny_yesterday_unchanged_today()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    for path in PUBLIC_PATHS:
+        status, response_headers, body = asgi_get(path)
+        assert body == client.get(path).data, path
+
+
+def test_asgi_conditional_requests(app, headers, asgi_get):
+    client = app.test_client()
+    post_test_data(client, headers)
+    wait_for_latest_write_time(app)
+
+    status, response_headers, body = asgi_get('/api/v1/public/states/daily')
+    assert status == 200
+    etag = response_headers['etag']
+
+    status, response_headers, body = asgi_get(
+        '/api/v1/public/states/daily', headers={'If-None-Match': etag})
+    assert status == 304
+    assert body == b''
+    status, _, _ = asgi_get('/api/v1/public/states/daily.csv',
+                            headers={'If-Modified-Since': response_headers['last-modified']})
+    assert status == 304
+
+    status, response_headers, body = asgi_get('/api/v1/public/states/daily.csv', method='HEAD')
+    assert status == 200
+    assert response_headers['content-type'] == 'text/csv'
+    assert body == b''
+
+
+def test_asgi_response_cache(app, asgi_get):
+    def add_state(state, name):
+        with app.app_context():
+            db.session.add(State(state=state, name=name, totalTestResultsFieldDbColumn='posNeg'))
+            db.session.commit()
+
+    def states_info(query=''):
+        status, _, body = asgi_get('/api/v1/public/states/info' + query)
+        assert status == 200
+        return len(json.loads(body))
+
+    add_state('NY', 'New York')
+
+    # write directly to the DB without going through the API: the cached response is served
+    assert states_info() == 1
+    add_state('WA', 'Washington')
+    assert states_info() == 1
+
+    # responses larger than the maximum entry size are not cached
+    app.extensions['response_cache'].max_entry_size = 10
+    assert states_info('?foo=bar') == 2
+    add_state('CA', 'California')
+    assert states_info('?foo=bar') == 3
@@ -1,6 +1,10 @@
 from datetime import datetime, date, timedelta
+import time
+
 import pytz
 
+from app.utils.cache import current_data_generation
+
 BEFORE_YESTERDAY = date(2020, 5, 20)
 YESTERDAY = date(2020, 5, 24)
 TODAY = date(2020, 5, 25)
@@ -284,3 +288,12 @@ def edit_unknown_fields():
       "context": ctx,
       "coreData": [edit_data]
     }
+
+
+def wait_for_latest_write_time(app):
+    """Wait until the time of the latest write (the data generation, see app/utils/cache.py) is
+    in the past. Writes in the same second move it ahead, and until then Last-Modified is clamped
+    to the current time and If-Modified-Since can't match."""
+    with app.app_context():
+        generation = current_data_generation()
+    time.sleep(max(0, generation + 1 - time.time()))
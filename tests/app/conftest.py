@@ -25,6 +25,10 @@ class TestingPostgresqlConfig:
     SLACK_API_TOKEN = 'dummy_token'
     SLACK_CHANNEL = 'some_channel'
 
+    # call the webhook right away, and retry without waiting
+    WEBHOOK_COALESCE_WINDOW = 0
+    WEBHOOK_RETRY_BACKOFF = 0
+
     @staticmethod
     def init_app(app):
         pass
@@ -38,6 +42,14 @@ def app():
        # Let SQLAlchemy do its thing and initialize the database
        db.create_all()
 
+    # notifications are sent in the background: wait for them at the end of each request, so tests
+    # can check what was sent
+    @app.teardown_request
+    def flush_notifications(exc):
+        # webhook failures are reported to Slack, so flush the webhook calls first
+        app.extensions['webhook_notifier'].dispatcher.flush()
+        app.extensions['slack_dispatcher'].flush()
+
     yield app
 
 @pytest.fixture
@@ -55,5 +67,5 @@ def headers(app):
 @pytest.fixture(autouse=True)
 def slack_mock():
     client_mock = MagicMock()
-    with mock.patch('app.utils.slacknotifier.WebClient', return_value=client_mock) as _fixture:
+    with mock.patch('app.utils.slacknotifier.PooledWebClient', return_value=client_mock) as _fixture:
         yield client_mock
@@ -1,7 +1,7 @@
 """
 Tests for CSV generation code (CSV endpoints are tested in ``public_test.py``
 """
-from app.api.csv import CSVColumn, make_csv_response
+from app.api.csv import CSVColumn, CSV_CHUNK_ROWS, make_csv_response
 
 from flask import json, jsonify
 
@@ -35,6 +35,22 @@ def test_make_csv_response(app):
         assert data[2] == "NV,,xyz,"
 
 
+def test_make_csv_response_streaming(app):
+    columns = [CSVColumn(label="State", model_column="state")]
+    # rows can come from a generator, and are written out in chunks as they are consumed
+    data = ({"state": "S%d" % i} for i in range(CSV_CHUNK_ROWS * 2 + 1))
+
+    with app.test_request_context():
+        resp = make_csv_response(columns, data)
+        assert resp.is_streamed
+        chunks = list(resp.response)
+        assert len(chunks) == 3
+        lines = "".join(chunks).splitlines()
+        assert lines[0] == "State"
+        assert lines[1] == "S0"
+        assert len(lines) == CSV_CHUNK_ROWS * 2 + 2
+
+
 def test_get_state_info_csv(app):
     client = app.test_client()
     with app.app_context():
@@ -0,0 +1,53 @@
+"""
+Tests for the per-request database settings
+"""
+from sqlalchemy import text
+
+from app import db
+from app.utils.database import statement_timeout
+
+
+def current_settings():
+    row = db.session.execute(text(
+        "SELECT current_setting('statement_timeout'), current_setting('application_name')")).first()
+    return {'statementTimeout': row[0], 'applicationName': row[1]}
+
+
+def test_request_settings(app):
+    app.add_url_rule('/settings', 'settings', current_settings)
+    app.add_url_rule('/public_settings', 'public_settings',
+                     statement_timeout('DB_PUBLIC_STATEMENT_TIMEOUT')(current_settings))
+    client = app.test_client()
+
+    # the defaults apply when the config doesn't set them
+    resp = client.get('/settings')
+    assert resp.status_code == 200
+    assert resp.json == {'statementTimeout': '30s', 'applicationName': 'covid-publishing-api:settings'}
+
+    app.config['DB_PUBLIC_STATEMENT_TIMEOUT'] = 5000
+    app.config['DB_APPLICATION_NAME'] = 'api-test'
+    resp = client.get('/public_settings')
+    assert resp.json == {'statementTimeout': '5s', 'applicationName': 'api-test:public_settings'}
+
+    # the settings are local to the request's transactions
+    with app.app_context():
+        assert current_settings()['statementTimeout'] == '0'
+
+
+def test_statement_timeout_cancels_query(app):
+    def slow_query():
+        db.session.execute(text('SELECT pg_sleep(0.5)'))
+        return 'done'
+
+    app.add_url_rule('/slow', 'slow', slow_query)
+    app.add_url_rule('/slow_ingest', 'slow_ingest',
+                     statement_timeout('DB_INGEST_STATEMENT_TIMEOUT')(slow_query))
+    app.config['DB_STATEMENT_TIMEOUT'] = 100
+    app.config['DB_INGEST_STATEMENT_TIMEOUT'] = 0
+    client = app.test_client()
+
+    resp = client.get('/slow')
+    assert resp.status_code == 503
+    # the connection is usable again
+    resp = client.get('/slow_ingest')
+    assert resp.status_code == 200
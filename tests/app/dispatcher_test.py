@@ -0,0 +1,64 @@
+import logging
+import threading
+
+from app.utils.dispatcher import BackgroundDispatcher
+
+
+def test_dispatcher_runs_jobs_in_background():
+    dispatcher = BackgroundDispatcher('test', logging.getLogger(__name__))
+    results = []
+    assert dispatcher.flush()  # nothing queued yet
+
+    for i in range(5):
+        assert dispatcher.submit(results.append, i)
+    assert dispatcher.flush(timeout=5)
+    assert results == [0, 1, 2, 3, 4]
+    dispatcher.shutdown()
+
+
+def test_dispatcher_retries():
+    failures = []
+    dispatcher = BackgroundDispatcher(
+        'test', logging.getLogger(__name__), retries=2, backoff=0.01,
+        on_failure=lambda job, args, kwargs, e: failures.append((args, str(e))))
+    attempts = []
+
+    def flaky(succeed_on):
+        attempts.append(1)
+        if len(attempts) < succeed_on:
+            raise ValueError('not yet')
+
+    dispatcher.submit(flaky, 3)
+    dispatcher.flush(timeout=5)
+    assert len(attempts) == 3
+    assert dispatcher.failed == 0
+
+    # the job is given up after all the retries failed
+    attempts.clear()
+    dispatcher.submit(flaky, 10)
+    dispatcher.flush(timeout=5)
+    assert len(attempts) == 3
+    assert dispatcher.failed == 1
+    assert failures == [((10,), 'not yet')]
+    dispatcher.shutdown()
+
+
+def test_dispatcher_drops_when_full_and_drains_on_shutdown():
+    dispatcher = BackgroundDispatcher('test', logging.getLogger(__name__), max_size=2)
+    release = threading.Event()
+    results = []
+
+    # block the worker on a first job, then fill the queue
+    dispatcher.submit(release.wait)
+    while dispatcher._queue.qsize():
+        pass
+    assert dispatcher.submit(results.append, 1)
+    assert dispatcher.submit(results.append, 2)
+    assert not dispatcher.submit(results.append, 3)
+    assert dispatcher.dropped == 1
+    assert not dispatcher.flush(timeout=0.01)
+
+    # pending jobs are run before shutting down
+    release.set()
+    dispatcher.shutdown()
+    assert results == [1, 2]
@@ -4,11 +4,13 @@ Edit testing for V1 of API
 from flask import json, jsonify
 
 from app import db
-from app.api.data import any_existing_rows
+from app.api.data import any_existing_rows, existing_state_pks, upsert_states
 from app.models.data import *
 from common import *
 import datetime
 
+import pytest
+
 
 def test_edit_state_metadata(app, headers, requests_mock):
     client = app.test_client()
@@ -53,6 +55,91 @@ def test_edit_state_metadata(app, headers, requests_mock):
     assert resp.json['states'][0]['twitter'] == "AlaskaNewTwitter"
     assert requests_mock.call_count == 1
 
+    # other fields are left alone by the upsert
+    resp = client.get('/api/v1/public/states/info')
+    assert resp.json[0]['twitter'] == "AlaskaNewTwitter"
+    assert resp.json[0]['covid19Site'] == "http://dhss.alaska.gov/dph/Epi/id/Pages/COVID-19/monitoring.aspx"
+
+
+def test_edit_state_metadata_batched(app, headers, requests_mock):
+    client = app.test_client()
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+
+    # several states in one request, including a repeated one: the last edit wins
+    state_data = {
+        'states': [
+            {'state': 'NY', 'twitter': 'first'},
+            {'state': 'WA', 'notes': 'new notes'},
+            {'state': 'NY', 'twitter': 'second'},
+        ]
+    }
+    resp = client.post(
+        "/api/v1/states/edit",
+        data=json.dumps(state_data),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    assert [s['state'] for s in resp.json['states']] == ['NY', 'WA', 'NY']
+    assert resp.json['states'][0]['twitter'] == 'second'
+    assert resp.json['states'][1]['notes'] == 'new notes'
+    assert resp.json['states'][1]['totalTestResultsFieldDbColumn'] == 'posNeg'
+
+    # an invalid totalTestResultsFieldDbColumn rejects the whole request
+    state_data = {
+        'states': [
+            {'state': 'NY', 'twitter': 'third'},
+            {'state': 'WA', 'totalTestResultsFieldDbColumn': 'notAColumn'},
+        ]
+    }
+    resp = client.post(
+        "/api/v1/states/edit",
+        data=json.dumps(state_data),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 500
+    resp = client.get('/api/v1/public/states/info')
+    assert {s['state']: s.get('twitter') for s in resp.json}['NY'] == 'second'
+
+    # editing a nonexistent state writes nothing
+    state_data = {'states': [{'state': 'NY', 'twitter': 'fourth'}, {'state': 'ZZ'}]}
+    resp = client.post(
+        "/api/v1/states/edit",
+        data=json.dumps(state_data),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 400
+
+
+def test_upsert_states_only_writes_given_fields(app, headers):
+    client = app.test_client()
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+
+    with app.app_context():
+        existing_states = existing_state_pks(['NY', 'WA'])
+        # a concurrent edit of another field of NY, between reading the states and writing them
+        db.session.query(State).filter_by(state='NY').update({'notes': 'concurrent notes'})
+        written = upsert_states(
+            [{'state': 'NY', 'twitter': 'new'}, {'state': 'WA', 'twitter': 'wa', 'notes': 'wa notes'}],
+            existing_states)
+        db.session.commit()
+
+        assert written[0]['twitter'] == 'new'
+        assert written[0]['notes'] == 'concurrent notes'
+        assert written[1]['notes'] == 'wa notes'
+        ny = State.query.get('NY')
+        assert ny.notes == 'concurrent notes'
+        assert ny.totalTestResultsFieldDbColumn == 'posNeg'
+
 
 def test_edit_core_data(app, headers, slack_mock, requests_mock):
     client = app.test_client()
@@ -119,6 +206,52 @@ def test_edit_core_data(app, headers, slack_mock, requests_mock):
             assert day_data['positive'] == 16
             assert day_data['negative'] == 4
 
+def test_edit_core_data_multiple_states(app, headers, slack_mock):
+    client = app.test_client()
+
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    batch_id = resp.json['batch']['batchId']
+    resp = client.post("/api/v1/batches/{}/publish".format(batch_id), headers=headers)
+    assert resp.status_code == 201
+
+    # an edit with no state in the context, touching both states on the same date, plus a new
+    # date for NY and an unchanged row for WA
+    wa_yesterday_edited = dict(WA_YESTERDAY, positive=11)
+    payload = edit_push_ny_yesterday()
+    payload['coreData'] += [wa_yesterday_edited, WA_TODAY.copy(), NY_BEFORE_YESTERDAY.copy()]
+    resp = client.post(
+        "/api/v1/batches/edit",
+        data=json.dumps(payload),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    assert resp.json['numRowsEdited'] == 3
+    assert set(resp.json['changedFields']) == {'positive', 'inIcuCurrently'}
+    edited = {(row['state'], row['date']): row for row in resp.json['coreData']}
+    assert set(edited) == {('NY', '2020-05-24'), ('WA', '2020-05-24'), ('NY', '2020-05-20')}
+    assert edited[('NY', '2020-05-24')]['positive'] == 16
+    assert 'inIcuCurrently' not in edited[('NY', '2020-05-24')]
+    assert edited[('WA', '2020-05-24')]['positive'] == 11
+    assert edited[('WA', '2020-05-24')]['negative'] == 8
+    assert edited[('WA', '2020-05-24')]['totalTestResults'] == 19
+    assert edited[('NY', '2020-05-20')]['positive'] == 10
+
+    # the rows read back after publishing match the rows returned by the edit
+    batch_id = resp.json['batch']['batchId']
+    assert {(row['state'], row['date']) for row in resp.json['batch']['coreData']} == set(edited)
+    resp = client.post("/api/v1/batches/{}/publish".format(batch_id), headers=headers)
+    assert resp.status_code == 201
+    resp = client.get("/api/v1/public/states/daily")
+    for row in resp.json:
+        if (row['state'], row['date']) in edited:
+            assert row == edited[(row['state'], row['date'])]
+
+
 def test_edit_core_data_from_states_daily_empty(app, headers, slack_mock, requests_mock):
     client = app.test_client()
 
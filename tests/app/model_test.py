@@ -1,7 +1,7 @@
 """
 Tests for SQLAlchemy models
 """
-from datetime import datetime
+from datetime import date, datetime
 import pytest
 import pytz
 
@@ -149,3 +149,124 @@ def test_total_test_results(app):
         assert core_data_row.totalTestResults is None
         core_data_row.totalTestsViral = 75
         assert core_data_row.totalTestResults == 75
+
+
+def test_total_test_results_expression(app):
+    # the SQL expression should agree with the hybrid property for every kind of source column
+    with app.app_context():
+        now_utc = datetime(2020, 5, 4, 20, 3, tzinfo=pytz.UTC)
+        bat = Batch(batchNote='test', createdAt=datetime.now(),
+                    isPublished=False, isRevision=False)
+        db.session.add(State(state='NY', totalTestResultsFieldDbColumn='posNeg'))
+        db.session.add(State(state='WA', totalTestResultsFieldDbColumn='posNeg'))
+        db.session.add(State(state='CA', totalTestResultsFieldDbColumn='totalTestsViral'))
+        db.session.add(State(state='AK', totalTestResultsFieldDbColumn='totalTestsViral'))
+        db.session.add(bat)
+        db.session.flush()
+
+        rows = [
+            dict(state='NY', positive=20, negative=5),
+            dict(state='WA', positive=20),
+            dict(state='CA', positive=20, negative=5, totalTestsViral=100),
+            dict(state='AK', positive=20, negative=5),
+        ]
+        for row in rows:
+            db.session.add(CoreData(date=now_utc.date(), batchId=bat.batchId, **row))
+        db.session.commit()
+
+        total_test_results = CoreData.total_test_results_expression(
+            CoreData, State.totalTestResultsFieldDbColumn)
+        results = db.session.query(CoreData, total_test_results).join(State).all()
+        assert len(results) == 4
+        for core_data, total in results:
+            assert core_data.totalTestResults == total
+
+
+def test_compiled_serializer():
+    # the compiled serializer must cover every column and hybrid property, in model order
+    columns, hybrids = CoreData._serializer
+    assert [name for name, _, _ in columns] == CoreData.__table__.columns.keys()
+    assert [name for name, _ in hybrids] == ['lastUpdateEt', 'totalTestResultsSource', 'totalTestResults']
+
+    now_utc = datetime(2020, 5, 4, 20, 3, tzinfo=pytz.UTC)
+    core_data_row = CoreData(
+        lastUpdateIsoUtc=now_utc.isoformat(), date='2020-05-04', state='NY', batchId=1,
+        positive=20, negative=None)
+    core_data_row.state_obj = State(state='NY', totalTestResultsFieldDbColumn='posNeg')
+    d = core_data_row.to_dict()
+    assert d['date'] == '2020-05-04'
+    assert d['lastUpdateTime'] == '2020-05-04T20:03:00Z'
+    assert d['positive'] == 20
+    assert 'negative' not in d
+    assert d['totalTestResults'] == 20
+    assert d['totalTestResultsSource'] == 'posNeg'
+
+
+def test_field_diffs_and_copy():
+    now_utc = datetime(2020, 5, 4, 20, 3, tzinfo=pytz.UTC)
+    core_data_row = CoreData(
+        lastUpdateIsoUtc=now_utc.isoformat(), date='2020-05-04', state='NY', batchId=1,
+        positive=20, negative=5, inIcuCurrently=33)
+
+    # only the fields present are compared, after normalizing dates and empty values
+    edit = {
+        'state': 'NY', 'date': '20200504', 'batchId': 2, 'lastUpdateIsoUtc': '2020-05-04T20:03:00Z',
+        'positive': 21, 'inIcuCurrently': '', 'notAColumn': 1}
+    fields = CoreData.normalized_fields(edit)
+    assert fields['lastUpdateTime'] == now_utc
+    assert fields['inIcuCurrently'] is None
+    assert 'notAColumn' not in fields and 'lastUpdateIsoUtc' not in fields
+
+    changed = core_data_row.diff_fields(fields)
+    assert changed.changed_values == [
+        ChangedValue(field='positive', old=20, new=21),
+        ChangedValue(field='inIcuCurrently', old=33, new=None)]
+    assert core_data_row.field_diffs(edit).changed_values == changed.changed_values
+    assert core_data_row.field_diffs({'state': 'NY', 'date': '2020-05-04', 'negative': 5}) is None
+
+    values = core_data_row.updated_values(fields)
+    assert set(values) == set(CoreData.__table__.columns.keys())
+    assert values['batchId'] == 2
+    assert values['positive'] == 21
+    assert values['negative'] == 5
+    assert values['inIcuCurrently'] is None
+    copy = core_data_row.copy_with_updates(**edit)
+    assert {name: getattr(copy, name) for name in values} == values
+
+
+def test_date_parsing():
+    # the common formats skip dateutil, but parse to the same values
+    for date_input in ['2020-05-04', '20200504', 20200504, '2020-05-04T04:00:00.000Z', 'May 4 2020',
+                       date(2020, 5, 4), datetime(2020, 5, 4, 23, tzinfo=pytz.UTC)]:
+        assert CoreData.parse_str_to_date(date_input) == date(2020, 5, 4)
+    with pytest.raises(ValueError):
+        CoreData.parse_str_to_date('2020-02-30')
+
+    expected = datetime(2020, 5, 4, 20, 3, tzinfo=pytz.UTC)
+    for datetime_str in ['2020-05-04T20:03:00Z', '2020-05-04T20:03:00.000Z', '2020-05-04T20:03Z',
+                         '2020-05-04 20:03:00+00:00', '2020-05-04T16:03:00-04:00',
+                         '2020-05-04T16:03:00-0400', 'May 4 2020 20:03 +0000']:
+        parsed = CoreData._parse_datetime_str(datetime_str)
+        assert parsed == expected
+        assert parsed.utcoffset() == expected.astimezone(parsed.tzinfo).utcoffset()
+    assert CoreData._parse_datetime_str('2020-05-04T20:03:00.5Z').microsecond == 500000
+
+    with pytest.raises(ValueError):
+        CoreData(state='NY', date='2020-05-04', lastUpdateIsoUtc='2020-05-04T20:03:00')
+
+
+def test_timestamp_formatting():
+    from app.utils.timeformat import format_csv_date_checked
+
+    summer = datetime(2020, 5, 4, 20, 3, tzinfo=pytz.UTC)
+    winter = datetime(2020, 12, 4, 20, 3, tzinfo=pytz.UTC)
+    for _ in range(2):  # the second round is served from the formatting caches
+        assert CoreData(state='NY', date='2020-05-04', lastUpdateTime=summer).lastUpdateEt == '5/4/2020 16:03'
+        assert CoreData(state='NY', date='2020-12-04', lastUpdateTime=winter).lastUpdateEt == '12/4/2020 15:03'
+        assert format_csv_date_checked(summer) == '5/04/2020 16:03'
+        assert format_csv_date_checked(winter) == '12/04/2020 16:03'
+
+    # the same instant in another timezone formats the same
+    eastern = summer.astimezone(pytz.timezone('US/Eastern'))
+    assert CoreData.__table__.columns['lastUpdateTime'].info['repr'](eastern) == '2020-05-04T20:03:00Z'
+    assert CoreData(state='NY', date='2020-05-04', lastUpdateTime=None).lastUpdateEt is None
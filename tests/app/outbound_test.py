@@ -0,0 +1,80 @@
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from app.utils.outbound import OutboundHTTP
+from app.utils.slacknotifier import PooledWebClient
+
+
+class SlackHandler(BaseHTTPRequestHandler):
+    """Answers every request like a successful Slack API call, keeping connections alive"""
+    protocol_version = 'HTTP/1.1'
+    received = []
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'] or 0))
+        self.received.append((self.path, self.headers['Content-Type'], body))
+        self.respond()
+
+    def respond(self):
+        body = json.dumps({'ok': True, 'ts': '1234.5678'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server_url():
+    SlackHandler.received = []
+    server = ThreadingServer(('127.0.0.1', 0), SlackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_outbound_connections_are_reused(server_url):
+    http = OutboundHTTP(pool_size=2, timeout=5)
+    for _ in range(5):
+        assert http.get(server_url).status_code == 200
+
+    assert http.stats() == {'requests': 5, 'connections': 1, 'reused': 4, 'poolSize': 2}
+
+
+def test_slack_client_uses_pooled_session(server_url):
+    http = OutboundHTTP(timeout=5)
+    client = PooledWebClient(http, token='dummy_token', base_url=server_url + 'api/')
+
+    assert client.chat_postMessage(channel='some_channel', text='hello')['ok']
+    assert client.files_upload(channels='some_channel', content='some content', title='Title')['ok']
+    assert client.files_upload(channels='some_channel', file=io.BytesIO(b'file content'))['ok']
+
+    (path, content_type, body), = [r for r in SlackHandler.received if 'postMessage' in r[0]]
+    assert content_type.startswith('application/json')
+    assert json.loads(body) == {'channel': 'some_channel', 'text': 'hello'}
+
+    uploads = [r for r in SlackHandler.received if 'files.upload' in r[0]]
+    assert uploads[0][1] == 'application/x-www-form-urlencoded'
+    assert b'content=some+content' in uploads[0][2]
+    assert uploads[1][1].startswith('multipart/form-data')
+    assert b'file content' in uploads[1][2]
+
+    # all the calls went through a single connection
+    assert http.stats()['requests'] == 3
+    assert http.stats()['connections'] == 1
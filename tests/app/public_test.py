@@ -1,7 +1,7 @@
 """
 Tests for public API endpoints
 """
-from datetime import date
+from datetime import date, datetime, timedelta
 from dateutil import parser
 import os
 import pytest
@@ -10,8 +10,13 @@ from flask import json, jsonify
 
 from app import db
 from app.models.data import *
+from app.api.common import make_json_array_response, states_daily_query, states_daily_rows_query, \
+    JSON_CHUNK_ITEMS
+from app.utils.cache import DataVersion, bump_data_generation, is_not_modified, \
+    last_modified_header, response_last_modified
 
-from common import daily_push_ny_wa_two_days, daily_push_ny_ca_total_test_results_different_source
+from common import daily_push_ny_wa_two_days, daily_push_ny_ca_total_test_results_different_source, \
+    edit_push_ny_yesterday_unchanged_today, wait_for_latest_write_time, YESTERDAY, TODAY
 
 
 def test_get_state_info(app):
@@ -217,3 +222,193 @@ def test_get_states_daily_for_state(app, headers):
     assert resp.json[1]['date'] == '2020-05-24'
     assert resp.json[1]['positive'] == 15
     assert resp.json[1]['negative'] == 4
+
+
+def test_latest_core_data_maintained_on_publish(app, headers):
+    test_data = daily_push_ny_wa_two_days()
+    client = app.test_client()
+
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(test_data),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    batch_id = resp.json['batch']['batchId']
+
+    # nothing is published yet, so there is no latest data
+    with app.app_context():
+        assert LatestCoreData.query.count() == 0
+
+    resp = client.post("/api/v1/batches/{}/publish".format(batch_id), headers=headers)
+    assert resp.status_code == 201
+    with app.app_context():
+        assert LatestCoreData.query.count() == 4
+        assert {x.batchId for x in LatestCoreData.query.all()} == {batch_id}
+
+    # publishing an edit should only move the pointer for the edited (state, date)
+    resp = client.post(
+        "/api/v1/batches/edit_states_daily",
+        data=json.dumps(edit_push_ny_yesterday_unchanged_today()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    edit_batch_id = resp.json['batch']['batchId']
+    with app.app_context():
+        assert LatestCoreData.query.count() == 4
+        latest = {(x.state, x.date): x.batchId for x in LatestCoreData.query.all()}
+        assert latest[('NY', YESTERDAY)] == edit_batch_id
+        assert latest[('NY', TODAY)] == batch_id
+        assert latest[('WA', YESTERDAY)] == batch_id
+
+    resp = client.get("/api/v1/public/states/NY/daily")
+    assert resp.json[1]['date'] == '2020-05-24'
+    assert resp.json[1]['positive'] == 16
+
+
+def test_public_response_cache(app):
+    client = app.test_client()
+    with app.app_context():
+        db.session.add(State(state='NY', name='New York', totalTestResultsFieldDbColumn='posNeg'))
+        db.session.commit()
+
+    resp = client.get("/api/v1/public/states/info")
+    assert resp.status_code == 200
+    assert len(resp.json) == 1
+
+    # write directly to the DB without going through the API: the cached response is served
+    with app.app_context():
+        db.session.add(State(state='WA', name='Washington', totalTestResultsFieldDbColumn='posNeg'))
+        db.session.commit()
+    resp = client.get("/api/v1/public/states/info")
+    assert len(resp.json) == 1
+
+    # different query args are cached separately
+    resp = client.get("/api/v1/public/states/info?foo=bar")
+    assert len(resp.json) == 2
+
+    # write paths bump the data generation, which invalidates the cache
+    with app.app_context():
+        bump_data_generation()
+    resp = client.get("/api/v1/public/states/info")
+    assert len(resp.json) == 2
+
+    # responses larger than the maximum entry size are not cached
+    app.extensions['response_cache'].max_entry_size = 10
+    assert len(client.get("/api/v1/public/states/info?foo=baz").json) == 2
+    assert client.get("/api/v1/public/states/info.csv?foo=baz").data.count(b'\n') == 3
+    with app.app_context():
+        db.session.add(State(state='CA', name='California', totalTestResultsFieldDbColumn='posNeg'))
+        db.session.commit()
+    assert len(client.get("/api/v1/public/states/info?foo=baz").json) == 3
+    assert client.get("/api/v1/public/states/info.csv?foo=baz").data.count(b'\n') == 4
+
+
+def test_last_modified_not_in_the_future():
+    past = datetime(2020, 10, 1, 12, 30)
+    assert last_modified_header(past) == past
+
+    # a database clock ahead of this server's
+    before = datetime.utcnow().replace(microsecond=0)
+    future = datetime.utcnow() + timedelta(hours=1)
+    assert before <= last_modified_header(future) <= datetime.utcnow()
+
+    # but conditional requests are checked against the time of the write
+    version = DataVersion(int((future - datetime(1970, 1, 1)).total_seconds()), 1, None)
+    last_modified = response_last_modified(version, {})
+    assert not is_not_modified('etag', last_modified, None, last_modified_header(last_modified))
+
+
+def test_public_conditional_requests(app, headers):
+    client = app.test_client()
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    batch_id = resp.json['batch']['batchId']
+    resp = client.post("/api/v1/batches/{}/publish".format(batch_id), headers=headers)
+    assert resp.status_code == 201
+    wait_for_latest_write_time(app)
+
+    resp = client.get("/api/v1/public/states/daily")
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+    last_modified = resp.headers['Last-Modified']
+    assert etag
+    assert last_modified
+
+    # unchanged data: 304 with an empty body
+    resp = client.get("/api/v1/public/states/daily", headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+    assert resp.headers['ETag'] == etag
+    resp = client.get("/api/v1/public/states/daily.csv", headers={'If-Modified-Since': last_modified})
+    assert resp.status_code == 304
+
+    # other endpoints and query args get different ETags
+    resp = client.get("/api/v1/public/states/daily?preview=true", headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert 'Last-Modified' not in resp.headers
+
+    # new data changes the ETag
+    resp = client.post(
+        "/api/v1/batches/edit_states_daily",
+        data=json.dumps(edit_push_ny_yesterday_unchanged_today()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    resp = client.get("/api/v1/public/states/daily", headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    # and Last-Modified, even though the edit didn't publish a batch
+    resp = client.get("/api/v1/public/states/daily.csv", headers={'If-Modified-Since': last_modified})
+    assert resp.status_code == 200
+    assert resp.headers['Last-Modified'] != last_modified
+
+    # so does editing state metadata
+    last_modified = resp.headers['Last-Modified']
+    resp = client.post(
+        "/api/v1/states/edit",
+        data=json.dumps({'states': [{'state': 'NY', 'twitter': '@NewYorkState'}]}),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    resp = client.get("/api/v1/public/states/info", headers={'If-Modified-Since': last_modified})
+    assert resp.status_code == 200
+
+
+def test_make_json_array_response(app):
+    with app.test_request_context():
+        resp = make_json_array_response({'n': i} for i in range(JSON_CHUNK_ITEMS * 2))
+        assert resp.is_streamed
+        assert resp.mimetype == 'application/json'
+        assert json.loads(resp.get_data()) == [{'n': i} for i in range(JSON_CHUNK_ITEMS * 2)]
+
+        resp = make_json_array_response(iter([]), key='batches')
+        assert json.loads(resp.get_data()) == {'batches': []}
+
+
+def test_states_daily_rows_query(app, headers):
+    client = app.test_client()
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_ca_total_test_results_different_source()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    resp = client.post("/api/v1/batches/1/publish", headers=headers)
+    assert resp.status_code == 201
+
+    # the column projection must serialize exactly like the ORM objects
+    with app.app_context():
+        for state in [None, 'CA', 'NY']:
+            entities = [x.to_dict() for x in states_daily_query(state=state)]
+            rows = [CoreData.row_to_dict(x) for x in states_daily_rows_query(state=state)]
+            assert len(rows) > 0
+            assert rows == entities
+
+        rows = states_daily_rows_query(limit=1).all()
+        assert len(rows) == 3
+        assert {x.date for x in rows} == {TODAY}
@@ -0,0 +1,125 @@
+"""
+Query plan regression tests for the hot coreData access paths
+"""
+from flask import json
+from sqlalchemy import text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app import db
+from app.api.common import published_state_date_query, states_daily_query, states_daily_rows_query
+from app.models.data import *
+from common import *
+
+
+class explain(Executable, ClauseElement):
+    """``EXPLAIN (FORMAT JSON)`` of a statement"""
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def index_names(scans):
+    """Return the names of the indexes used by scans, looking into bitmap scans"""
+    return [index_node['Index Name'] for node in scans for index_node in plan_nodes(node)
+            if 'Index Name' in index_node]
+
+
+# a year of daily pushes for 56 states, with a few edits and a pending push: big enough for the
+# planner to prefer the indexes over reading whole tables, like it does on the real data
+SEED_STATES = 56
+SEED_DAYS = 365
+SEED_SQL = [
+    """INSERT INTO states (state, name, "totalTestResultsFieldDbColumn")
+       SELECT 'S' || i, 'State ' || i, 'posNeg' FROM generate_series(1, :states) i""",
+    # one published daily batch per day, edits of the same day every week, and a preview batch
+    """INSERT INTO batches ("batchId", "createdAt", "dataEntryType", "isPublished", "isRevision")
+       SELECT 1000 + i, now() - (:days - i) * interval '1 day', 'daily', true, false
+       FROM generate_series(1, :days) i""",
+    """INSERT INTO batches ("batchId", "createdAt", "dataEntryType", "isPublished", "isRevision")
+       SELECT 2000 + i, now() - (:days - i) * interval '1 day', 'edit', true, true
+       FROM generate_series(7, :days, 7) i""",
+    """INSERT INTO batches ("batchId", "createdAt", "dataEntryType", "isPublished", "isRevision")
+       VALUES (3000, now(), 'daily', false, false)""",
+    """INSERT INTO "coreData" (state, "batchId", date, positive, negative)
+       SELECT s.state, b."batchId", DATE '2020-01-01' + (b."batchId" % 1000), 1, 2
+       FROM states s, batches b WHERE b."batchId" < 3000""",
+    """INSERT INTO "coreData" (state, "batchId", date, positive, negative)
+       SELECT state, 3000, DATE '2020-01-01' + :days + 1, 1, 2 FROM states""",
+    """INSERT INTO "latestCoreData" (state, date, "batchId")
+       SELECT c.state, c.date, max(c."batchId") FROM "coreData" c JOIN batches b USING ("batchId")
+       WHERE b."isPublished" GROUP BY c.state, c.date
+       ON CONFLICT (state, date) DO UPDATE SET "batchId" = excluded."batchId"
+    """,
+    'ANALYZE',
+]
+
+
+def seed_history():
+    for statement in SEED_SQL:
+        db.session.execute(text(statement), {'states': SEED_STATES - 2, 'days': SEED_DAYS})
+    db.session.commit()
+
+
+def table_scans(query):
+    """Return the plan nodes scanning the coreData tables for a query"""
+    plan = db.session.execute(explain(query.statement)).scalar()[0]['Plan']
+    scans = [node for node in plan_nodes(plan)
+             if node.get('Relation Name') in ('coreData', 'latestCoreData')]
+    assert scans
+    return scans
+
+
+def assert_indexed(scans):
+    for node in scans:
+        # a scan without an index condition reads the whole table, just like a sequential scan
+        assert node['Node Type'] != 'Seq Scan', node
+        assert node['Node Type'] == 'Bitmap Heap Scan' or 'Index Cond' in node, node
+
+
+def test_core_data_query_plans(app, headers):
+    client = app.test_client()
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    batch_id = resp.json['batch']['batchId']
+    resp = client.post("/api/v1/batches/{}/publish".format(batch_id), headers=headers)
+    assert resp.status_code == 201
+    resp = client.post(
+        "/api/v1/batches/edit_states_daily",
+        data=json.dumps(edit_push_ny_yesterday_unchanged_today()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+
+    with app.app_context():
+        seed_history()
+
+        # state date history and existence checks
+        scans = table_scans(published_state_date_query('NY', YESTERDAY))
+        assert index_names(scans) == ['ix_coreData_state_date_batchId']
+        assert_indexed(scans)
+
+        # rows of a batch
+        scans = table_scans(CoreData.query.filter(CoreData.batchId == 1100))
+        assert index_names(scans) == ['ix_coreData_batchId']
+        assert_indexed(scans)
+
+        # states daily for a state, published and preview
+        assert_indexed(table_scans(states_daily_query('NY')))
+        assert_indexed(table_scans(states_daily_query('NY', preview=True)))
+        assert_indexed(table_scans(states_daily_rows_query(state='NY')))
+        assert_indexed(table_scans(states_daily_query('NY', dates=[YESTERDAY, TODAY])))
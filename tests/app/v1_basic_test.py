@@ -1,7 +1,10 @@
 """
 Basic Test for V1 of API
 """
+from contextlib import contextmanager
+
 from flask import json, jsonify
+from sqlalchemy import event
 
 from app import db
 from app.api.data import any_existing_rows
@@ -40,6 +43,13 @@ def test_post_core_data(app, headers):
         content_type='application/json',
         headers=headers)
     assert resp.status_code == 201
+    # the response contains the written rows, in the order they were sent
+    posted_core_data = resp.json['coreData']
+    assert len(posted_core_data) == 56 * 2
+    assert posted_core_data[0]['state'] == 'AK'
+    assert posted_core_data[0]['batchId'] == 1
+    assert posted_core_data[0]['lastUpdateTime'] == '2020-06-18T04:00:00Z'
+    assert posted_core_data[0]['totalTestResultsSource'] == 'totalTestEncountersViral'
 
     # we should've written 56 states times 2 days, 4 core data rows, 1 batch
     resp = client.get('/api/v1/public/states/info')
@@ -65,6 +75,10 @@ def test_post_core_data(app, headers):
     # the entry for AL uses lastUpdateTime instead of lastUpdateIsoUtc, confirming it works
     assert resp.json['batches'][0]['coreData'][1]['lastUpdateTime'] == '2020-06-18T15:00:00Z'
 
+    # rows written in bulk serialize exactly like rows read back from the DB
+    key = lambda x: (x['state'], x['date'])
+    assert sorted(posted_core_data, key=key) == sorted(resp.json['batches'][0]['coreData'], key=key)
+
 
 def test_post_core_data_updating_state(app, headers):
     with app.app_context():
@@ -127,6 +141,178 @@ def test_get_batches(app):
     assert resp.json['batchNote'] == 'test1'
 
 
+@contextmanager
+def recorded_statements(app):
+    """Record the SQL statements executed in the block, but the per-request settings that
+    begin each transaction (see app/utils/database.py)"""
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith("SELECT set_config('statement_timeout'"):
+            statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record_statement)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+
+def test_get_batches_query_count(app, headers):
+    client = app.test_client()
+
+    def get_batches():
+        with recorded_statements(app) as statements:
+            resp = client.get('/api/v1/batches')
+            resp.get_data()  # the response is streamed
+        assert resp.status_code == 200
+        return resp.json['batches'], len(statements)
+
+    resp = client.post(
+        "/api/v1/batches",
+        data=json.dumps(daily_push_ny_wa_two_days()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+    batches, num_queries = get_batches()
+    assert len(batches) == 1
+
+    for payload in (daily_push_ny_wa_two_days(), daily_push_ny_ca_total_test_results_different_source()):
+        resp = client.post(
+            "/api/v1/batches",
+            data=json.dumps(payload),
+            content_type='application/json',
+            headers=headers)
+        assert resp.status_code == 201
+    with app.app_context():
+        db.session.add(Batch(batchNote='empty', isPublished=False, isRevision=False))
+        db.session.commit()
+
+    # more batches, but the same number of queries
+    batches, more_batches_num_queries = get_batches()
+    assert len(batches) == 4
+    assert more_batches_num_queries == num_queries
+
+    # the changed dates computed in SQL match the ones computed from the coreData rows
+    for batch in batches:
+        resp = client.get('/api/v1/batches/{}'.format(batch['batchId']))
+        assert resp.json == batch
+    assert batches[0]['changedDatesMin'] != batches[0]['changedDatesMax']
+    assert batches[3]['changedDatesMin'] is None
+    assert batches[3]['coreData'] == []
+
+
+def test_get_batches_pagination_and_filters(app, headers):
+    client = app.test_client()
+    for payload in (daily_push_ny_wa_two_days(), daily_push_ny_wa_two_days(),
+                    daily_push_ny_ca_total_test_results_different_source()):
+        resp = client.post(
+            "/api/v1/batches",
+            data=json.dumps(payload),
+            content_type='application/json',
+            headers=headers)
+        assert resp.status_code == 201
+    resp = client.post("/api/v1/batches/2/publish", headers=headers)
+    assert resp.status_code == 201
+    resp = client.post(
+        "/api/v1/batches/edit_states_daily",
+        data=json.dumps(edit_push_ny_yesterday_unchanged_today()),
+        content_type='application/json',
+        headers=headers)
+    assert resp.status_code == 201
+
+    def batch_ids(query_string):
+        resp = client.get('/api/v1/batches' + query_string)
+        assert resp.status_code == 200
+        return [batch['batchId'] for batch in resp.json['batches']]
+
+    # keyset pagination
+    assert batch_ids('') == [1, 2, 3, 4]
+    assert batch_ids('?limit=3') == [1, 2, 3]
+    assert batch_ids('?limit=3&after=3') == [4]
+    assert batch_ids('?after=4') == []
+
+    # pages have a default size, and a maximum one, but without paging arguments all the
+    # batches are listed
+    app.config['BATCHES_PAGE_SIZE'] = 2
+    app.config['BATCHES_MAX_PAGE_SIZE'] = 3
+    assert batch_ids('') == [1, 2, 3, 4]
+    assert batch_ids('?after=0') == [1, 2]
+    assert batch_ids('?after=2') == [3, 4]
+    assert batch_ids('?limit=10') == [1, 2, 3]
+    del app.config['BATCHES_PAGE_SIZE']
+    del app.config['BATCHES_MAX_PAGE_SIZE']
+
+    # filters
+    assert batch_ids('?isPublished=true') == [2, 4]
+    assert batch_ids('?isPublished=false') == [1, 3]
+    assert batch_ids('?dataEntryType=edit') == [4]
+    assert batch_ids('?dataEntryType=weekly') == []
+    assert batch_ids('?state=ca') == [3]
+    assert batch_ids('?state=NY&isPublished=false&after=1') == [3]
+
+    # invalid values are rejected rather than ignored
+    for query_string in ('?limit=0', '?limit=many', '?after=x', '?isPublished=maybe',
+                         '?coreData=nope'):
+        assert client.get('/api/v1/batches' + query_string).status_code == 400
+
+    # omitting the coreData rows keeps the changed dates
+    resp = client.get('/api/v1/batches?coreData=false&limit=1')
+    batch = resp.json['batches'][0]
+    assert 'coreData' not in batch
+    single_batch = client.get('/api/v1/batches/1').json
+    del single_batch['coreData']
+    assert single_batch == batch
+    assert batch['changedDatesMin'] is not None
+
+
+def test_get_batches_summary(app, headers):
+    client = app.test_client()
+    for payload in (daily_push_ny_wa_two_days(), daily_push_ny_ca_total_test_results_different_source()):
+        resp = client.post(
+            "/api/v1/batches",
+            data=json.dumps(payload),
+            content_type='application/json',
+            headers=headers)
+        assert resp.status_code == 201
+    with app.app_context():
+        db.session.add(Batch(batchNote='empty', isPublished=False, isRevision=False))
+        db.session.commit()
+
+    resp = client.get('/api/v1/batches?view=summary')
+    assert resp.status_code == 200
+    summaries = resp.json['batches']
+    assert [summary['batchId'] for summary in summaries] == [1, 2, 3]
+    full_batches = client.get('/api/v1/batches').json['batches']
+    for summary, batch in zip(summaries, full_batches):
+        assert 'coreData' not in summary
+        # the summary has the same fields as the full view, null ones left out alike
+        for field in ('batchId', 'createdAt', 'publishedAt', 'shiftLead', 'batchNote',
+                      'dataEntryType', 'isPublished', 'isRevision', 'changedDatesMin',
+                      'changedDatesMax'):
+            assert (field in summary) == (field in batch), field
+            assert summary.get(field) == batch.get(field), field
+        assert summary['numRows'] == len(batch['coreData'])
+        assert summary['states'] == sorted({row['state'] for row in batch['coreData']})
+    assert summaries[0]['states'] == ['NY', 'WA']
+    assert summaries[2]['numRows'] == 0
+    assert summaries[2]['states'] == []
+
+    # the pagination and filters apply too
+    resp = client.get('/api/v1/batches?view=summary&state=CA')
+    assert [summary['batchId'] for summary in resp.json['batches']] == [2]
+    resp = client.get('/api/v1/batches?view=summary&after=1&limit=1')
+    assert [summary['batchId'] for summary in resp.json['batches']] == [2]
+
+    # single batch
+    resp = client.get('/api/v1/batches/2?view=summary')
+    assert resp.status_code == 200
+    assert resp.json == summaries[1]
+    assert client.get('/api/v1/batches/10?view=summary').status_code == 404
+    assert client.get('/api/v1/batches/2?view=everything').status_code == 400
+
+
 def test_publish_batch(app, headers, requests_mock):
     with app.app_context():
         # write 2 batches
@@ -289,8 +475,10 @@ def test_get_state_date_history(app, headers):
         headers=headers)
     second_batch_id = resp.json['batch']['batchId']
 
-    # get history for NY yesterday, should have two rows
-    resp = client.get("/api/v1/state-date-history/NY/2020-05-24")
+    # get history for NY yesterday, should have two rows, read with a single statement
+    with recorded_statements(app) as statements:
+        resp = client.get("/api/v1/state-date-history/NY/2020-05-24")
+    assert len(statements) == 1
     assert len(resp.json) == 2
     assert resp.json[0]['batchId'] == second_batch_id  # most recent first
     assert resp.json[0]['positive'] == 16
@@ -300,6 +488,13 @@ def test_get_state_date_history(app, headers):
     assert resp.json[1]['batchId'] == first_batch_id
     assert resp.json[1]['positive'] == 15
 
+    # the embedded batches match the batches themselves, without their coreData rows
+    for elem in resp.json:
+        batch = client.get("/api/v1/batches/{}".format(elem['batchId'])).json
+        del batch['coreData']
+        assert elem['batch'] == batch
+    assert resp.json[1]['batch']['changedDatesMin'] == 'Sun, 24 May 2020 00:00:00 GMT'
+
     # history for NY today should have just one row
     resp = client.get("/api/v1/state-date-history/NY/2020-05-25")
     assert len(resp.json) == 1
@@ -1,9 +1,12 @@
+import time
+
 import pytest
 import requests_mock
 from flask import Response
 from requests import HTTPError
 
 from app.api import api
+from app.utils.slacknotifier import dispatcher
 from app.utils.webhook import do_notify_webhook, notify_webhook
 
 
@@ -11,27 +14,82 @@ def test_do_notify_webhook(app, requests_mock, slack_mock):
     with app.app_context():
         url = 'http://example.com/web/hook'
         app.config['API_WEBHOOK_URL'] = url
+        notifier = app.extensions['webhook_notifier']
         requests_mock.get(url, json= {'it': 'worked'})
-        resp = do_notify_webhook()
+        assert do_notify_webhook()
+        notifier.dispatcher.flush()
         assert requests_mock.call_count == 1
-        assert resp.json() == {'it': 'worked'}
+        assert requests_mock.last_request.timeout == notifier.timeout
         # nothing should be posted to slack for a successful operation
         assert slack_mock.chat_postMessage.call_count == 0
         assert slack_mock.files_upload.call_count == 0
 
+        # failed calls are retried, then reported to slack
         requests_mock.get(url, status_code=500)
-        resp = do_notify_webhook()
-        assert requests_mock.call_count == 2
-        # error should be reported to slack
+        assert do_notify_webhook()
+        notifier.dispatcher.flush()
+        assert requests_mock.call_count == 1 + notifier.dispatcher.retries + 1
+        dispatcher().flush()
         assert slack_mock.files_upload.call_count == 1
 
         # try with a bad url/error in request
         requests_mock.register_uri('GET', url, exc=HTTPError),
-        resp = do_notify_webhook()
-        assert resp is False
+        assert do_notify_webhook()
+        notifier.dispatcher.flush()
+        dispatcher().flush()
         # error should be reported to slack
         assert slack_mock.files_upload.call_count == 2
 
+        # nothing to call without a url
+        app.config['API_WEBHOOK_URL'] = ''
+        assert not do_notify_webhook()
+
+
+def test_webhook_coalescing(app, requests_mock):
+    with app.app_context():
+        url = 'http://example.com/web/hook'
+        app.config['API_WEBHOOK_URL'] = url
+        notifier = app.extensions['webhook_notifier']
+        requests_mock.get(url, json= {'it': 'worked'})
+
+        # a burst of triggers within the window results in a single call, at the end of it
+        notifier.window = 0.5
+        assert do_notify_webhook()
+        for _ in range(4):
+            assert not do_notify_webhook()
+        assert requests_mock.call_count == 0
+        notifier.dispatcher.flush()
+        assert requests_mock.call_count == 1
+        assert notifier.coalesced == 4
+
+        # a trigger after the call was made results in another call
+        notifier.window = 0
+        assert do_notify_webhook()
+        notifier.dispatcher.flush()
+        assert requests_mock.call_count == 2
+
+
+def test_webhook_called_on_shutdown(app, requests_mock):
+    with app.app_context():
+        url = 'http://example.com/web/hook'
+        app.config['API_WEBHOOK_URL'] = url
+        notifier = app.extensions['webhook_notifier']
+        requests_mock.get(url, json= {'it': 'worked'})
+
+        # a call waiting for the end of its window is made right away when the process exits
+        notifier.window = 60
+        assert do_notify_webhook()
+        start = time.monotonic()
+        notifier.dispatcher.shutdown(timeout=5)
+        assert requests_mock.call_count == 1
+        assert time.monotonic() - start < 5
+
+        # and triggers are handled again by a new thread after that
+        notifier.window = 0
+        assert do_notify_webhook()
+        notifier.dispatcher.flush()
+        assert requests_mock.call_count == 2
+
 
 def test_webhook_decorator(app, requests_mock, slack_mock):
     with app.app_context():
@@ -45,6 +103,7 @@ def test_webhook_decorator(app, requests_mock, slack_mock):
             return "blah blah", 201
         assert requests_mock.call_count == 0
         successful_function()
+        app.extensions['webhook_notifier'].dispatcher.flush()
         assert requests_mock.call_count == 1
         assert slack_mock.files_upload.call_count == 0
 